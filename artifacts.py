@@ -0,0 +1,222 @@
+import gzip
+import json
+import os
+from dotenv import load_dotenv
+import staging
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# What a reader hits at the torn tail of a file whose writer was killed mid-write
+TRUNCATION_ERRORS = (EOFError, OSError, ValueError) + ((zstandard.ZstdError,) if zstandard else ())
+
+load_dotenv()
+
+JSON_FOLDER = "json_files"
+# "" writes plain .ndjson; "gzip" or "zstd" compress the stage artifacts
+ARTIFACT_COMPRESSION = os.getenv("ARTIFACT_COMPRESSION", "")
+# "files" hands artifacts over as NDJSON files; "sqlite" stages them in json_files/staging.db
+STAGING_BACKEND = os.getenv("STAGING_BACKEND", "files")
+
+EXTENSIONS = {
+    "": ".ndjson",
+    "gzip": ".ndjson.gz",
+    "zstd": ".ndjson.zst",
+}
+
+def artifact_path(name, compression=None, folder=JSON_FOLDER):
+    """Returns the path a stage should write artifact `name` (e.g. "result1") to."""
+    if compression is None:
+        compression = ARTIFACT_COMPRESSION
+    if compression not in EXTENSIONS:
+        raise ValueError(f"Unsupported artifact compression '{compression}'. Use one of: gzip, zstd")
+    return os.path.join(folder, name + EXTENSIONS[compression])
+
+def find_artifact(name, folder=JSON_FOLDER):
+    """Returns the newest existing file for artifact `name`, including legacy .json dumps."""
+    candidates = [os.path.join(folder, name + ext) for ext in list(EXTENSIONS.values()) + [".json"]]
+    existing = [path for path in candidates if os.path.exists(path)]
+    if not existing:
+        raise FileNotFoundError(f"No artifact found for '{name}' in '{folder}'")
+    return max(existing, key=os.path.getmtime)
+
+def open_text(path, mode="r"):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError("Reading or writing .zst artifacts requires the zstandard package (pip install zstandard)")
+        return zstandard.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+def read_records(path, tolerate_truncation=False):
+    """Yields records one at a time from an NDJSON artifact or a legacy JSON array file.
+
+    With `tolerate_truncation`, reading stops quietly at a torn tail instead
+    of raising, which is how partial files from a crashed run are salvaged.
+    """
+    if path.endswith(".json"):
+        # Legacy whole-file dumps can only be parsed in one go
+        with open(path, "r") as f:
+            yield from json.load(f)
+        return
+
+    try:
+        with open_text(path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    except TRUNCATION_ERRORS:
+        if not tolerate_truncation:
+            raise
+
+class RecordWriter:
+    """Writes records as NDJSON, one line per record.
+
+    Records go to a hidden `.partial-<name>` file next to `path` and are
+    renamed into place on a clean close, so an interrupted stage never
+    leaves a truncated artifact behind under the real name.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        folder, name = os.path.split(path)
+        self.partial_path = os.path.join(folder, ".partial-" + name)
+        self.salvage_path = os.path.join(folder, ".salvage-" + name)
+        self.count = 0
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        if resume and not os.path.exists(self.salvage_path):
+            # Salvage from the interrupted partial file, or from a finished but incomplete earlier run
+            previous = self.partial_path if os.path.exists(self.partial_path) else path
+            if os.path.exists(previous):
+                os.replace(previous, self.salvage_path)
+        elif not resume and os.path.exists(self.salvage_path):
+            # A leftover from an earlier interrupted run is stale once we start over
+            os.remove(self.salvage_path)
+        self.file = open_text(self.partial_path, "w")
+
+    def salvage(self, keep=None):
+        """Copies intact records left by an interrupted run into this writer.
+
+        Yields each record that is kept, so the caller can work out what
+        is already done. `keep` filters which records survive.
+        """
+        if not os.path.exists(self.salvage_path):
+            return
+        for record in read_records(self.salvage_path, tolerate_truncation=True):
+            if keep is None or keep(record):
+                self.write(record)
+                yield record
+        os.remove(self.salvage_path)
+
+    def write(self, record):
+        self.write_encoded(json.dumps(record, separators=(",", ":")))
+
+    def write_encoded(self, line, key=None):
+        """Writes a record that is already JSON-encoded on one line; `key` is only used by the SQLite writer."""
+        self.file.write(line)
+        self.file.write("\n")
+        self.count += 1
+
+    def write_all(self, records):
+        for record in records:
+            self.write(record)
+
+    def flush(self):
+        """Pushes written records to disk, so a ledger flushed after this never claims lost output."""
+        self.file.flush()
+        try:
+            os.fsync(self.file.fileno())
+        except (AttributeError, OSError):
+            # Some compressed streams expose no file descriptor; their flushed blocks are still readable
+            pass
+
+    def close(self, commit=True):
+        self.file.close()
+        if commit:
+            os.replace(self.partial_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(commit=exc_type is None)
+
+def write_records(path, records):
+    with RecordWriter(path) as writer:
+        writer.write_all(records)
+    return writer.count
+
+def merge_records(base_path, changes, output_path, key="id"):
+    """Streams `base_path` into `output_path`, replacing records whose key appears in `changes`.
+
+    `changes` (a list of records) is held in memory; changed records missing
+    from the base are appended at the end. Returns the number of records written.
+    """
+    changed = {record.get(key): record for record in changes}
+    with RecordWriter(output_path) as writer:
+        if base_path and os.path.exists(base_path):
+            for record in read_records(base_path):
+                writer.write(changed.pop(record.get(key), record))
+        writer.write_all(changed.values())
+    return writer.count
+
+def merge_delta(name, key="id", suffix=".delta"):
+    """Merges the `<name><suffix>` artifact (a delta run, or a replay) into artifact `name`; returns (changed, total)."""
+    if use_staging():
+        return staging.merge_staged_delta(name, suffix)
+    changes = list(read_records(find_artifact(name + suffix)))
+    try:
+        base_path = find_artifact(name)
+    except FileNotFoundError:
+        base_path = None
+    return len(changes), merge_records(base_path, changes, artifact_path(name), key)
+
+def use_staging():
+    if STAGING_BACKEND not in ("files", "sqlite"):
+        raise ValueError(f"Unsupported STAGING_BACKEND '{STAGING_BACKEND}'. Use files or sqlite")
+    return STAGING_BACKEND == "sqlite"
+
+def open_writer(name, resume=False, key="id"):
+    """Opens the writer for artifact `name` on the configured backend; `key` identifies records in SQLite."""
+    if use_staging():
+        return staging.TableWriter(name, key=key, resume=resume)
+    return RecordWriter(artifact_path(name), resume=resume)
+
+def open_reader(name, pending_only=False):
+    """Streams artifact `name` from the configured backend; `pending_only` skips rows already marked posted."""
+    if use_staging():
+        if not staging.artifact_exists(name):
+            raise FileNotFoundError(f"No artifact '{name}' in {staging.STAGING_DB}")
+        return staging.read_staged(name, pending_only)
+    return read_records(find_artifact(name))
+
+def open_line_reader(name):
+    """Streams artifact `name` as one JSON text per record, for consumers that decode elsewhere (e.g. worker processes)."""
+    if use_staging():
+        if not staging.artifact_exists(name):
+            raise FileNotFoundError(f"No artifact '{name}' in {staging.STAGING_DB}")
+        return staging.read_staged(name, decode=False)
+    path = find_artifact(name)
+    if path.endswith(".json"):
+        return (json.dumps(record, separators=(",", ":")) for record in read_records(path))
+    return read_lines(path)
+
+def read_lines(path):
+    with open_text(path) as f:
+        for line in f:
+            if line.strip():
+                yield line
+
+def count_artifact(name):
+    """Number of records in artifact `name`, without decoding them where the backend allows."""
+    if use_staging():
+        return staging.count_staged(name)
+    path = find_artifact(name)
+    if path.endswith(".json"):
+        return sum(1 for _ in read_records(path))
+    with open_text(path) as f:
+        return sum(1 for line in f if line.strip())
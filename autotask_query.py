@@ -0,0 +1,147 @@
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import http_client
+from http_client import AUTOTASK_API_ROOT, autotask_headers
+from projection import include_fields
+
+FETCH_WORKERS = int(os.getenv("AUTOTASK_FETCH_WORKERS", "4"))
+# Number of id ranges each filter shard is split into (1 = shard on filter values only)
+ID_SHARDS = int(os.getenv("AUTOTASK_ID_SHARDS", "1"))
+# Autotask rejects queries without a filter; this one matches every record
+ALL_IDS = [{"op": "gt", "field": "id", "value": 0}]
+
+def query_url(entity):
+    return f"{AUTOTASK_API_ROOT}/{entity}/query"
+
+def search_params(filters, **options):
+    return {"search": json.dumps({"filter": filters, **options})}
+
+def count_records(entity, filters):
+    response = http_client.get(f"{query_url(entity)}/count", headers=autotask_headers(), params=search_params(filters))
+    response.raise_for_status()
+    return response.json().get("queryCount", 0)
+
+def first_id(entity, filters):
+    # Query results come back in ascending id order, so one record gives the lower bound
+    response = http_client.get(query_url(entity), headers=autotask_headers(), params=search_params(filters, MaxRecords=1, IncludeFields=["id"]))
+    response.raise_for_status()
+    items = response.json().get("items", [])
+    return items[0]["id"] if items else None
+
+def last_id(entity, filters, low):
+    """Finds the highest id matching `filters` with /query/count probes (exponential, then binary search)."""
+    step = 1
+    while count_records(entity, filters + [{"op": "gt", "field": "id", "value": low + step}]):
+        step *= 2
+    lo, hi = low + step // 2, low + step
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if count_records(entity, filters + [{"op": "gt", "field": "id", "value": mid}]):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+def plan_id_ranges(entity, filters, parts):
+    """Splits the id space matching `filters` into `parts` equal-width (low, high] ranges."""
+    if parts <= 1:
+        return [None]
+    filters = filters or ALL_IDS
+    low = first_id(entity, filters)
+    if low is None:
+        return [None]
+    high = last_id(entity, filters, low)
+    width = max(1, -(-(high - low + 1) // parts))
+    ranges = []
+    start = low - 1
+    while start < high:
+        ranges.append((start, min(start + width, high)))
+        start += width
+    logging.info(f"Planned {len(ranges)} id ranges for {entity} between {low} and {high}")
+    return ranges
+
+def plan_shards(entity, field, values, base_filters=None, id_shards=ID_SHARDS):
+    """Builds one shard per filter value, each optionally split further into id ranges.
+
+    Shard keys are stable strings so a progress ledger can track them across runs.
+    """
+    base_filters = base_filters or []
+    id_ranges = plan_id_ranges(entity, base_filters, id_shards)
+    shards = []
+    for value in values:
+        for id_range in id_ranges:
+            filters = base_filters + [{"op": "eq", "field": field, "value": value}]
+            key = f"{field}={value}"
+            if id_range:
+                filters += [
+                    {"op": "gt", "field": "id", "value": id_range[0]},
+                    {"op": "lte", "field": "id", "value": id_range[1]},
+                ]
+                key += f"|id={id_range[0]}-{id_range[1]}"
+            shards.append({"key": key, "filter": filters})
+    return shards
+
+def fetch_shard(entity, shard, deliver, ledger=None):
+    """Follows one shard's nextPageUrl chain, handing each page to `deliver`. Returns True when it finished.
+
+    A shard the ledger holds a cursor for picks up from that page. Only the
+    fields declared in projection.py are requested.
+    """
+    next_page_url = ledger.cursors.get(shard["key"]) if ledger else None
+    request_count = 0
+    fields = include_fields(entity)
+    options = {"IncludeFields": fields} if fields else {}
+
+    while True:
+        url = next_page_url or query_url(entity)
+        params = search_params(shard["filter"], **options) if not next_page_url else {}
+
+        try:
+            logging.info(f"Fetching {entity} shard {shard['key']} from {url}...")
+            response = http_client.get(url, headers=autotask_headers(), params=params)
+            request_count += 1
+            response.raise_for_status()
+            data = response.json()
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Request failed for {entity} shard {shard['key']}: {str(e)}. Skipping this shard.")
+            return False
+
+        next_page_url = data.get("pageDetails", {}).get("nextPageUrl")
+        deliver(shard, data.get("items", []), next_page_url)
+        if not next_page_url:
+            logging.info(f"No more pages for {entity} shard {shard['key']} after {request_count} requests.")
+            return True
+
+def fetch_partitioned(entity, shards, on_items, workers=FETCH_WORKERS, ledger=None, seen_ids=None):
+    """Fetches all shards concurrently and passes each page's not-yet-seen records to `on_items`.
+
+    `on_items(shard, items)` runs under a lock, one page at a time, so it can
+    write to a shared artifact. Records are deduplicated by id across shards.
+    Ledger cursors are saved under the same lock, after the page is handed over.
+    Returns the number of shards that completed.
+    """
+    seen_ids = set() if seen_ids is None else seen_ids
+    lock = threading.Lock()
+
+    def deliver(shard, items, next_page_url):
+        with lock:
+            fresh = []
+            for item in items:
+                if item.get("id") not in seen_ids:
+                    seen_ids.add(item.get("id"))
+                    fresh.append(item)
+            on_items(shard, fresh)
+            if ledger and next_page_url:
+                ledger.save_cursor(shard["key"], next_page_url)
+            elif ledger:
+                ledger.mark_done(shard["key"])
+
+    pending = [shard for shard in shards if not (ledger and ledger.is_done(shard["key"]))]
+    logging.info(f"Fetching {entity}: {len(pending)} of {len(shards)} shards pending, {workers} workers")
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = list(executor.map(lambda shard: fetch_shard(entity, shard, deliver, ledger), pending))
+    return len(shards) - len(pending) + sum(results)
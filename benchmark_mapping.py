@@ -0,0 +1,96 @@
+import argparse
+import importlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+def write_json(folder, name, data):
+    with open(os.path.join(folder, name), "w") as f:
+        json.dump(data, f)
+
+def generate_reference_data(folder, contacts, resources):
+    write_json(folder, "all_priority.json", [{"id": i, "name": f"P{i}"} for i in range(1, 5)])
+    write_json(folder, "all_status.json", [{"id": i, "name": f"S{i}"} for i in range(1, 20)])
+    write_json(folder, "all_contacts.json", [
+        {"id": i, "firstName": "First", "lastName": f"Contact{i}", "emailAddress": f"contact{i}@example.com"}
+        for i in range(contacts)
+    ])
+    write_json(folder, "atera_contacts.json", [
+        {"EndUserID": 100000 + i, "Email": f"Contact{i}@Example.com"}
+        for i in range(contacts)
+    ])
+    write_json(folder, "all_resources.json", [
+        {"id": i, "firstName": "First", "lastName": f"Resource{i}", "email": f"resource{i}@example.com"}
+        for i in range(resources)
+    ])
+    write_json(folder, "atera_technicians.json", [
+        {"$id": str(i + 1), "ContactID": 500 + i, "Email": f"resource{i}@example.com"}
+        for i in range(resources)
+    ])
+
+def generate_tickets(count, contacts, resources, notes_per_ticket):
+    rng = random.Random(count)
+    tickets = []
+    for i in range(count):
+        notes = []
+        for n in range(notes_per_ticket):
+            by_resource = rng.random() < 0.5
+            notes.append({
+                "noteType": 1,
+                "createDateTime": "2024-01-01T00:00:00Z",
+                "description": f"Note {n}",
+                "creatorResourceID": rng.randrange(resources) if by_resource else None,
+                "createdByContactID": None if by_resource else rng.randrange(contacts),
+            })
+        tickets.append({
+            "id": i,
+            "title": f"Ticket {i}",
+            "description": "Synthetic ticket",
+            "priority": rng.randint(1, 4),
+            "status": rng.randint(1, 19),
+            "issueType": rng.randint(1, 5),
+            "ticketType": rng.randint(1, 4),
+            "contactID": rng.randrange(contacts),
+            "assignedResourceID": rng.randrange(resources),
+            "notes": notes,
+        })
+    return tickets
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark script3 payload mapping against ticket count.")
+    parser.add_argument("--contacts", type=int, default=40000)
+    parser.add_argument("--resources", type=int, default=500)
+    parser.add_argument("--notes", type=int, default=5, help="Notes per ticket")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2500, 5000, 10000, 20000])
+    parser.add_argument("--workers", type=int, default=1, help="Mapping processes (script3 --workers); above 1, JSON decoding and encoding are timed too")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as workdir:
+        os.makedirs(os.path.join(workdir, "json_files"))
+        generate_reference_data(os.path.join(workdir, "json_files"), args.contacts, args.resources)
+        os.chdir(workdir)
+        script3 = importlib.import_module("script3_tickets")
+        # Reference data loads lazily; load it up front so the first size is not charged for it
+        start = time.perf_counter()
+        script3.preload_reference()
+        print(f"Reference data loaded in {time.perf_counter() - start:.3f}s")
+
+        print(f"{'tickets':>10} {'seconds':>10} {'us/ticket':>10}")
+        for size in args.sizes:
+            tickets = generate_tickets(size, args.contacts, args.resources, args.notes)
+            if args.workers > 1:
+                lines = [json.dumps(ticket) for ticket in tickets]
+                start = time.perf_counter()
+                sum(1 for _ in script3.map_encoded(lines, workers=args.workers))
+            else:
+                start = time.perf_counter()
+                script3.handler(tickets)
+            elapsed = time.perf_counter() - start
+            print(f"{size:>10} {elapsed:>10.3f} {elapsed / size * 1e6:>10.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from mock_server import MockServer, generate_dataset
+
+SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+# Stage order of a full migration, with the flags each one is benchmarked with
+STAGES = [
+    ("contacts_migration", []),
+    ("fetch_atera_contacts", []),
+    ("fetch_resources", []),
+    ("script1_tickets", []),
+    ("script2_tickets", ["--rps", "0", "--batch-size", "{batch_size}", "--workers", "{workers}"]),
+    ("script3_tickets", []),
+    ("script4_tickets", ["--workers", "{workers}"]),
+]
+
+def write_reference_data(folder, resources):
+    """Hand-saved reference files; priorities and statuses come from the mock's Tickets picklists."""
+    os.makedirs(folder, exist_ok=True)
+    files = {
+        "atera_technicians.json": [{"$id": str(i + 1), "ContactID": 500 + i, "Email": f"resource{i}@example.com"} for i in range(resources)],
+    }
+    for name, data in files.items():
+        with open(os.path.join(folder, name), "w") as f:
+            json.dump(data, f)
+
+def run_stage(name, args, workdir, env):
+    """Runs one script to completion; returns (exit code, wall seconds, peak RSS in MB or None)."""
+    command = [sys.executable, os.path.join(SCRIPT_FOLDER, f"{name}.py")] + args
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=workdir, env=env, stdout=subprocess.DEVNULL)
+    if hasattr(os, "wait4"):
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        peak_rss = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    else:
+        process.wait()
+        peak_rss = None
+    return process.returncode, time.perf_counter() - start, peak_rss
+
+def stage_records(workdir, name):
+    path = os.path.join(workdir, "json_files", "metrics", f"{name}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f).get("records")
+
+def benchmark(args):
+    dataset = generate_dataset(args.tickets, args.notes, args.contacts, args.resources)
+    options = {"latency": args.latency, "jitter": args.jitter, "error_rate": args.error_rate, "throttle_rate": args.throttle_rate}
+    selected = [stage for stage in STAGES if not args.stages or stage[0] in args.stages]
+    results = []
+
+    with tempfile.TemporaryDirectory() as workdir, MockServer(dataset, **options) as server:
+        write_reference_data(os.path.join(workdir, "json_files"), args.resources)
+        env = dict(
+            os.environ,
+            AUTOTASK_API_ROOT=server.autotask_root,
+            ATERA_API_ROOT=server.atera_root,
+            # Injected faults should cost retries, not real backoff time
+            HTTP_BACKOFF_BASE="0.01",
+            HTTP_BACKOFF_CAP="0.1",
+        )
+        for name, flags in selected:
+            stage_args = [flag.format(workers=args.workers, batch_size=args.batch_size) for flag in flags]
+            returncode, seconds, peak_rss = run_stage(name, stage_args, workdir, env)
+            records = stage_records(workdir, name)
+            results.append({
+                "stage": name,
+                "exit_code": returncode,
+                "seconds": round(seconds, 3),
+                "records": records,
+                "records_per_second": round(records / seconds, 1) if records is not None and seconds else None,
+                "peak_rss_mb": round(peak_rss, 1) if peak_rss is not None else None,
+            })
+        requests = server.state.requests
+
+    return {"config": {**vars(args), "mock_requests": requests}, "results": results}
+
+def print_report(report, baseline=None):
+    previous = {result["stage"]: result for result in baseline["results"]} if baseline else {}
+    print(f"{'stage':<22} {'exit':>4} {'seconds':>9} {'records':>9} {'records/s':>10} {'peak MB':>8} {'vs base':>8}")
+    for result in report["results"]:
+        change = ""
+        before = previous.get(result["stage"], {}).get("records_per_second")
+        if before and result["records_per_second"]:
+            change = f"{(result['records_per_second'] / before - 1) * 100:+.0f}%"
+        print(
+            f"{result['stage']:<22} {result['exit_code']:>4} {result['seconds']:>9.2f} {str(result['records']):>9}"
+            f" {str(result['records_per_second']):>10} {str(result['peak_rss_mb']):>8} {change:>8}"
+        )
+    print(f"Mock server handled {report['config']['mock_requests']} requests.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every migration stage against a local mock Autotask/Atera server.")
+    parser.add_argument("--tickets", type=int, default=2000)
+    parser.add_argument("--notes", type=int, default=3, help="Notes per ticket")
+    parser.add_argument("--contacts", type=int, default=1000)
+    parser.add_argument("--resources", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=4, help="--workers passed to script2 and script4")
+    parser.add_argument("--batch-size", type=int, default=0, help="--batch-size passed to script2")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds the mock adds to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random extra latency, up to this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--stages", nargs="+", help="Only run these stages (later stages need earlier outputs)")
+    parser.add_argument("--output", help="Save the results as JSON, e.g. to compare versions")
+    parser.add_argument("--baseline", help="Results JSON from an earlier run to compare records/s against")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+
+    report = benchmark(args)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+
+if __name__ == "__main__":
+    main()
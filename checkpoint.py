@@ -0,0 +1,126 @@
+import json
+import logging
+import os
+import threading
+import time
+
+CHECKPOINT_FOLDER = os.path.join("json_files", "checkpoints")
+
+class AppendLog:
+    """Append-only NDJSON log whose entries are buffered and flushed in batches.
+
+    A flush writes every buffered entry with one write and one fsync, so
+    recording progress per item stays cheap. `before_flush` runs first, which
+    lets a stage flush its output artifact before the log claims the work is done.
+    """
+
+    def __init__(self, path, flush_every=500, flush_interval=5.0, before_flush=None):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.before_flush = before_flush
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.last_flush = time.monotonic()
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+    def read(self):
+        """Yields the entries already on disk, ignoring a torn last line."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    logging.warning(f"Ignoring unreadable entry in {self.path}")
+
+    def reset(self):
+        with self.lock:
+            self.buffer = []
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def append(self, entry):
+        with self.lock:
+            self.buffer.append(entry)
+            due = len(self.buffer) >= self.flush_every or time.monotonic() - self.last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if self.before_flush:
+                self.before_flush()
+            if self.buffer:
+                lines = "".join(json.dumps(entry, separators=(",", ":")) + "\n" for entry in self.buffer)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(lines)
+                    f.flush()
+                    os.fsync(f.fileno())
+                self.buffer = []
+            self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        # Whatever before_flush guarded is usually closed right after this
+        self.before_flush = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class ProgressLedger(AppendLog):
+    """Durable per-stage record of finished work: completed keys and pagination cursors."""
+
+    def __init__(self, stage, resume=False, **kwargs):
+        super().__init__(os.path.join(CHECKPOINT_FOLDER, f"{stage}.ledger"), **kwargs)
+        self.stage = stage
+        self.done = set()
+        self.cursors = {}
+        self.plan = None
+        self.complete = False
+        if resume:
+            self.load()
+        else:
+            self.reset()
+
+    def load(self):
+        for entry in self.read():
+            key = entry.get("key")
+            if entry.get("complete"):
+                self.complete = True
+            elif "plan" in entry:
+                self.plan = entry["plan"]
+            elif entry.get("done"):
+                self.done.add(key)
+                self.cursors.pop(key, None)
+            elif "cursor" in entry:
+                self.cursors[key] = entry["cursor"]
+        logging.info(f"Resuming {self.stage}: {len(self.done)} items done, {len(self.cursors)} cursors open")
+
+    def is_done(self, key):
+        return key in self.done
+
+    def mark_done(self, key):
+        self.done.add(key)
+        self.append({"key": key, "done": True})
+
+    def save_cursor(self, key, cursor):
+        self.cursors[key] = cursor
+        self.append({"key": key, "cursor": cursor})
+
+    def save_plan(self, plan):
+        """Records how the stage split its work, so a resumed run reuses the same keys."""
+        self.plan = plan
+        self.append({"plan": plan})
+        self.flush()
+
+    def mark_complete(self):
+        self.complete = True
+        self.append({"complete": True})
+        self.flush()
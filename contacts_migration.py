@@ -1,41 +1,53 @@
+import argparse
 import os
 import requests
 import json
-import time
 import logging
+import logs
 from dotenv import load_dotenv
+import http_client
+from http_client import ATERA_API_ROOT, atera_headers
+from autotask_query import FETCH_WORKERS, ID_SHARDS, fetch_partitioned, plan_shards
+from watermarks import WatermarkTracker, delta_filters, get_watermark, save_watermark
+from workers import WorkQueue
+from id_map import IdMap
+from dead_letters import DeadLetters
+import metrics
+import staging
+from artifacts import use_staging
+from functools import partial
 
 load_dotenv()
 
-LOG_FOLDER = 'log_info'
-if not os.path.exists(LOG_FOLDER):
-    os.makedirs(LOG_FOLDER)
-
-logging.basicConfig(
-    filename=os.path.join(LOG_FOLDER, 'contacts_migration.log'),
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-)
-
-BASE_URL = "https://webservices14.autotask.net/ATServicesRest/V1.0/Contacts/query"
-ATERA_API_URL = 'https://app.atera.com/api/v3/contacts'
-HEADERS = {
-    "ApiIntegrationCode": os.getenv("API_INTEGERATION_CODE"),
-    "UserName": os.getenv("USER_NAME"),
-    "Secret": os.getenv("SECRET")
-}
-
-ATERA_API_TOKEN = os.getenv("ATERA_API_KEY")
-
-error_log = []
-
-def post_to_atera(contact):
-    """Uploads a single contact to Atera and logs any errors."""
-    headers = {
-        'X-API-KEY': ATERA_API_TOKEN,
-        'Accept': 'application/json'
-    }
-    
+logs.setup(os.path.join(logs.LOG_FOLDER, 'contacts_migration.log'))
+
+ATERA_API_URL = f"{ATERA_API_ROOT}/contacts"
+ACTIVE_VALUES = [0, 1]
+CONTACTS_FILE = os.path.join("json_files", 'all_contacts.json')
+UPLOAD_WORKERS = int(os.getenv("CONTACT_UPLOAD_WORKERS", "4"))
+# Contacts allowed to wait between the Autotask fetch and the Atera upload pool
+UPLOAD_QUEUE_SIZE = int(os.getenv("CONTACT_UPLOAD_QUEUE_SIZE", "1000"))
+# Where replay.py finds the payload of a failed upload
+CONTACT_PAYLOAD = {"file": CONTACTS_FILE, "key": "id"}
+
+def created_id(response):
+    """The new contact's EndUserID, which Atera returns as ActionID."""
+    try:
+        return response.json().get("ActionID")
+    except ValueError:
+        return None
+
+def post_to_atera(contact, id_map=None, dead_letters=None):
+    """Uploads a single contact to Atera; returns True once it is there.
+
+    Contacts already recorded in `id_map` are skipped; new ones are recorded
+    with their EndUserID from the response, so tickets resolve them without
+    a refetch of every Atera contact. Failed uploads go to `dead_letters`.
+    """
+    if id_map and id_map.has("contact", contact.get('id')):
+        logging.info("Contact %s already migrated, skipping.", contact.get('emailAddress'))
+        return True
+
     atera_contact = {
         "Email": contact.get("emailAddress"),
         "Firstname": contact.get("firstName"),
@@ -48,90 +60,86 @@ def post_to_atera(contact):
     }
 
     try:
-        response = requests.post(ATERA_API_URL, headers=headers, json=atera_contact, timeout=60)
+        response = http_client.post(ATERA_API_URL, headers=atera_headers(), json=atera_contact)
         response.raise_for_status()
-        logging.info(f"Contact {contact.get('emailAddress')} uploaded successfully to Atera.")
+        logging.info("Contact %s uploaded successfully to Atera.", contact.get('emailAddress'))
+        if id_map:
+            id_map.record("contact", contact.get('id'), created_id(response))
+        return True
     except requests.exceptions.RequestException as e:
         error_message = f"Failed to upload contact {contact.get('emailAddress')}: {str(e)}"
         logging.error(error_message)
+        if dead_letters:
+            dead_letters.record(contact.get('id'), e, email=contact.get('emailAddress'))
+        return False
 
-        error_log.append({
-            "contact_email": contact.get('emailAddress'),
-            "contact_id": contact.get('id'),
-            "error_message": str(e)
-        })
+def load_existing_contacts():
+    if not os.path.exists(CONTACTS_FILE):
+        return []
+    with open(CONTACTS_FILE, "r") as contacts_file:
+        return json.load(contacts_file)
 
-def fetch_contacts(value, max_retries=3):
+def handler(workers=FETCH_WORKERS, id_shards=ID_SHARDS, delta=False, upload_workers=UPLOAD_WORKERS):
     all_contacts = []
-    request_count = 0
-    next_page_url = None
-    retries = 0
-
-    search_payload = {
-        "filter": [{"op": "eq", "field": "isActive", "value": value}]
-    }
-
-    while True:
-        url = next_page_url if next_page_url else BASE_URL
-        params = {'search': json.dumps(search_payload)} if not next_page_url else {}
-
-        try:
-            response = requests.get(url, headers=HEADERS, params=params, timeout=60)
-            request_count += 1
-            logging.info(f"Request {request_count}: Sending request to {url} with params {params}.")
-            response.raise_for_status()
-
-            data = response.json()
-            all_contacts.extend(data.get("items", []))
-
-            for contact in data.get("items", []):
-                post_to_atera(contact)
-
-            next_page_url = data.get("pageDetails", {}).get("nextPageUrl")
-            if not next_page_url:
-                break
-
-        except requests.exceptions.Timeout:
-            retries += 1
-            logging.warning(f"Timeout occurred for active status {value}. Retrying... ({retries}/{max_retries})")
-            if retries >= max_retries:
-                logging.error(f"Max retries reached for active status {value}. Skipping this active status.")
-                break
-            time.sleep(10 * retries)
-
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Request failed for active status {value}: {str(e)}. Skipping this active status.")
-            break
-
-    return all_contacts
-
-def handler():
-    all_contacts = []
-
-    for isActive in range(0, 2):
-        logging.info(f"Fetching contacts for active status {isActive}...")
-        contacts = fetch_contacts(isActive)
-        all_contacts.extend(contacts)
+    since = get_watermark("Contacts") if delta else None
+    if delta and since is None:
+        logging.warning("No Contacts watermark saved yet; running a full fetch instead of a delta.")
+        delta = False
+
+    # In a delta run, contacts already in all_contacts.json were uploaded before and are only refreshed locally
+    existing_contacts = load_existing_contacts() if delta else []
+    known_ids = {contact.get('id') for contact in existing_contacts}
+    tracker = WatermarkTracker("Contacts")
+
+    # A full run uploads every contact not yet in the id map again, so earlier failures are retried anyway
+    dead_letters = DeadLetters("contacts_migration", CONTACT_PAYLOAD, reset=not delta)
+
+    # Autotask paging feeds a bounded queue drained by the Atera upload pool, so both APIs stay busy
+    with IdMap() as id_map, dead_letters, WorkQueue(partial(post_to_atera, id_map=id_map, dead_letters=dead_letters), upload_workers, UPLOAD_QUEUE_SIZE) as uploads:
+
+        def upload_contacts(shard, contacts):
+            logging.info(f"Fetched {len(contacts)} contacts for {shard['key']}.")
+            all_contacts.extend(contacts)
+            tracker.observe(contacts)
+            metrics.add_records(len(contacts))
+            for contact in contacts:
+                if contact.get('id') not in known_ids:
+                    uploads.put(contact)
+
+        base_filters = delta_filters("Contacts", since) if delta else None
+        shards = plan_shards("Contacts", "isActive", ACTIVE_VALUES, base_filters, id_shards)
+        completed = fetch_partitioned("Contacts", shards, upload_contacts, workers)
+
+    if delta:
+        changed = {contact.get('id'): contact for contact in all_contacts}
+        merged = [changed.pop(contact.get('id'), contact) for contact in existing_contacts]
+        logging.info(f"Merging {len(all_contacts)} changed contacts ({len(changed)} new) into 'all_contacts.json'.")
+        all_contacts = merged + list(changed.values())
 
     # Save all contacts to all_contacts.json
     try:
-        with open(os.path.join("json_files", 'all_contacts.json'), "w") as contacts_file:
+        with open(CONTACTS_FILE, "w") as contacts_file:
             json.dump(all_contacts, contacts_file, indent=4)
         logging.info("All contacts saved to 'all_contacts.json'.")
+        if use_staging():
+            staging.store_reference("contacts", all_contacts)
+        if completed == len(shards):
+            save_watermark("Contacts", tracker.value or since)
     except Exception as e:
         logging.error(f"Failed to save contacts to 'all_contacts.json': {str(e)}")
 
-    if error_log:
-        try:
-            with open("error_log.json", "w") as error_file:
-                json.dump(error_log, error_file, indent=4)
-            logging.info("Errors logged in 'error_log.json'.")
-        except Exception as e:
-            logging.error(f"Failed to save error log: {str(e)}")
+    if dead_letters.count:
+        logging.error(f"{dead_letters.count} contacts failed to upload; see '{dead_letters.path}' and run 'python replay.py contacts_migration'.")
     else:
         logging.info("No errors occurred during the upload process.")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch Autotask contacts, upload them to Atera and save them locally.")
+    parser.add_argument("--delta", action="store_true", help="Fetch only contacts changed since the last run; upload only new ones")
+    parser.add_argument("--upload-workers", type=int, default=UPLOAD_WORKERS, help="Concurrent Atera contact uploads")
+    args = parser.parse_args()
+    metrics.start_stage("contacts_migration")
+
     logging.info("Starting the contact fetch process.")
-    handler()
+    handler(delta=args.delta, upload_workers=args.upload_workers)
     logging.info("Process completed.")
\ No newline at end of file
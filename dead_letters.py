@@ -0,0 +1,57 @@
+import os
+import time
+from checkpoint import AppendLog
+
+DEAD_LETTER_FOLDER = os.path.join("json_files", "dead_letters")
+
+def http_status(error):
+    """HTTP status behind a failure, or None when no response came back."""
+    response = getattr(error, "response", None)
+    return response.status_code if response is not None else None
+
+def http_attempts(error, default=1):
+    """Attempts http_client made before giving up on the request behind `error`."""
+    attempts = getattr(error, "attempts", None)
+    if attempts is None:
+        attempts = getattr(getattr(error, "response", None), "attempts", None)
+    return attempts or default
+
+class DeadLetters(AppendLog):
+    """Items a stage gave up on, one NDJSON entry per failure.
+
+    Each entry holds the item's source ID, a reference to its payload (the
+    artifact or file and key to find it by), the HTTP status (None without a
+    response), the attempt count and the error. replay.py retries the pending
+    items and appends a "resolved" entry for each one that makes it.
+    """
+
+    def __init__(self, stage, payload=None, reset=False, flush_every=50, flush_interval=1.0):
+        super().__init__(os.path.join(DEAD_LETTER_FOLDER, f"{stage}.ndjson"), flush_every=flush_every, flush_interval=flush_interval)
+        self.stage = stage
+        self.payload = payload
+        self.count = 0
+        if reset:
+            self.reset()
+
+    def record(self, source_id, error=None, status=None, attempts=None, payload=None, **details):
+        self.count += 1
+        self.append({
+            "source_id": source_id,
+            "payload": payload or self.payload,
+            "status": status if status is not None else http_status(error),
+            "attempts": attempts if attempts is not None else http_attempts(error),
+            "error": str(error) if error is not None else None,
+            "time": time.time(),
+            **details,
+        })
+
+    def resolve(self, source_id):
+        self.append({"source_id": source_id, "resolved": True, "time": time.time()})
+
+    def pending(self):
+        """Latest failure entry per source ID, leaving out items resolved since."""
+        self.flush()
+        latest = {}
+        for entry in self.read():
+            latest[entry["source_id"]] = entry
+        return [entry for entry in latest.values() if not entry.get("resolved")]
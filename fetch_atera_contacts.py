@@ -1,61 +1,83 @@
+import argparse
 import requests
 import json
 import os
-import time
 import logging
+import logs
 from dotenv import load_dotenv
+import http_client
+import metrics
+import staging
+from artifacts import use_staging
+from http_client import ATERA_API_ROOT, atera_headers
+from id_map import IdMap, match_by_email
+from workers import ordered_map
 
 load_dotenv()
 
-BASE_URL = "https://app.atera.com/api/v3/contacts"
-API_KEY = os.getenv("ATERA_API_KEY")
+BASE_URL = f"{ATERA_API_ROOT}/contacts"
+CONTACTS_FILE = os.path.join("json_files", "all_contacts.json")
+# Atera caps itemsInPage at 50
+ATERA_PAGE_SIZE = int(os.getenv("ATERA_PAGE_SIZE", "50"))
+FETCH_WORKERS = int(os.getenv("ATERA_FETCH_WORKERS", "4"))
 
-log_folder = 'log_info'
-log_file = os.path.join(log_folder, 'fetch_atera_contacts.log')
-os.makedirs(log_folder, exist_ok=True)
+logs.setup(os.path.join(logs.LOG_FOLDER, 'fetch_atera_contacts.log'))
 
-logging.basicConfig(
-    filename=log_file,
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
-
-def fetch_contacts(max_retries=3):
-    all_contacts = []
-    retries = 0
-    next_page_url = BASE_URL  # Start with the base URL for the first page
-
-    headers = {
-        'X-API-KEY': API_KEY,  # Use X-API-KEY instead of Authorization
-        'Accept': 'application/json'
-    }
+def fetch_page(page, page_size=ATERA_PAGE_SIZE):
+    """Fetches one listing page; a page that still fails after http_client's retries is skipped, not the whole listing."""
+    try:
+        response = http_client.get(BASE_URL, headers=atera_headers(), params={"page": page, "itemsInPage": page_size})
+        response.raise_for_status()
+        return response.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logging.error(f"Request for contacts page {page} failed: {e}")
+        if hasattr(e, 'response') and e.response is not None:
+            logging.error(f"Response status code: {e.response.status_code}")
+            logging.error(f"Response body: {e.response.text}")
+        return None
 
+def follow_next_links(data):
+    """Sequential fallback for listings that do not report totalPages."""
+    contacts = list(data.get("items", []))
+    next_page_url = data.get("nextLink")
     while next_page_url:
         try:
             logging.info(f"Fetching contacts from {next_page_url}")
-            response = requests.get(next_page_url, headers=headers)
-            response.raise_for_status()  # Raise exception for HTTP errors
-
+            response = http_client.get(next_page_url, headers=atera_headers())
+            response.raise_for_status()
             data = response.json()
-            all_contacts.extend(data.get("items", []))
-
-            next_page_url = data.get("nextLink")
-
-        except requests.exceptions.Timeout:
-            logging.warning(f"Timeout occurred. Retrying... ({retries + 1}/{max_retries})")
-            retries += 1
-            if retries >= max_retries:
-                logging.error("Max retries reached!")
-                break
-            time.sleep(10 * retries)  # Exponential backoff
-
         except requests.exceptions.RequestException as e:
             logging.error(f"Request failed: {e}")
-            if hasattr(e, 'response') and e.response is not None:
-                logging.error(f"Response status code: {e.response.status_code}")
-                logging.error(f"Response body: {e.response.text}")
             break
+        contacts.extend(data.get("items", []))
+        metrics.add_records(len(data.get("items", [])))
+        next_page_url = data.get("nextLink")
+    return contacts
+
+def fetch_contacts(workers=FETCH_WORKERS, page_size=ATERA_PAGE_SIZE):
+    """Reads page 1 for totalPages, then fetches the other pages concurrently and keeps them in page order."""
+    first = fetch_page(1, page_size)
+    if first is None:
+        logging.error("Could not fetch the first contacts page.")
+        return []
+    metrics.add_records(len(first.get("items", [])))
+    total_pages = first.get("totalPages")
+    if not total_pages:
+        return follow_next_links(first)
 
+    logging.info(f"Fetching {total_pages} pages of {page_size} contacts with {workers} workers")
+    all_contacts = list(first.get("items", []))
+    failed_pages = []
+    pages = range(2, total_pages + 1)
+    for page, data in zip(pages, ordered_map(lambda page: fetch_page(page, page_size), pages, workers)):
+        if data is None:
+            failed_pages.append(page)
+            continue
+        all_contacts.extend(data.get("items", []))
+        metrics.add_records(len(data.get("items", [])))
+
+    if failed_pages:
+        logging.error(f"Contacts pages {failed_pages} could not be fetched; their contacts are missing from the file.")
     logging.info(f"Total contacts fetched: {len(all_contacts)}")
     return all_contacts
 
@@ -66,13 +88,32 @@ def save_contacts_to_file(contacts, filename=os.path.join("json_files", "atera_c
         json.dump(contacts, f, indent=4)
     logging.info(f"Data saved to '{filename}'.")
 
-def handler():
+def reconcile(atera_contacts):
+    """Fills crosswalk gaps (contacts that existed in Atera before, or whose post response was lost) by email."""
+    if not os.path.exists(CONTACTS_FILE):
+        logging.warning(f"'{CONTACTS_FILE}' not found; nothing to reconcile.")
+        return
+    with open(CONTACTS_FILE, "r") as f:
+        contacts = json.load(f)
+    with IdMap() as id_map:
+        written = match_by_email(id_map, "contact", contacts, "emailAddress", atera_contacts, "EndUserID", keep_existing=True)
+        missing = sum(1 for contact in contacts if id_map.get("contact", contact.get("id")) is None)
+    logging.info(f"Crosswalk: {written} contacts reconciled by email; {missing} Autotask contacts have no Atera EndUserID.")
+
+def handler(workers=FETCH_WORKERS):
     logging.info("Starting the fetch process for contacts...")
-    contacts = fetch_contacts()
+    contacts = fetch_contacts(workers)
     if contacts:
         save_contacts_to_file(contacts)
+        if use_staging():
+            staging.store_reference("atera_contacts", contacts)
+        reconcile(contacts)
     else:
         logging.warning("No contacts were fetched.")
 
 if __name__ == "__main__":
-    handler()
+    parser = argparse.ArgumentParser(description="Fetch all Atera contacts into atera_contacts.json.")
+    parser.add_argument("--workers", type=int, default=FETCH_WORKERS, help="Contact pages fetched concurrently")
+    args = parser.parse_args()
+    metrics.start_stage("fetch_atera_contacts")
+    handler(args.workers)
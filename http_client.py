@@ -0,0 +1,209 @@
+import email.utils
+import logging
+import os
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+import metrics
+from workers import AdaptiveLimiter
+
+load_dotenv()
+
+AUTOTASK_API_ROOT = os.getenv("AUTOTASK_API_ROOT", "https://webservices14.autotask.net/ATServicesRest/V1.0")
+ATERA_API_ROOT = os.getenv("ATERA_API_ROOT", "https://app.atera.com/api/v3")
+
+AUTOTASK_POOL_SIZE = int(os.getenv("AUTOTASK_POOL_SIZE", "10"))
+ATERA_POOL_SIZE = int(os.getenv("ATERA_POOL_SIZE", "10"))
+
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "60"))
+MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "5"))
+BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "1"))
+BACKOFF_CAP = float(os.getenv("HTTP_BACKOFF_CAP", "60"))
+
+# Per-host concurrency adapts to 429s, latency and Autotask quota usage (0 turns it off)
+ADAPTIVE_CONCURRENCY = os.getenv("ADAPTIVE_CONCURRENCY", "1") != "0"
+TARGET_LATENCY = float(os.getenv("HTTP_TARGET_LATENCY", "5"))
+AUTOTASK_MAX_CONCURRENCY = int(os.getenv("AUTOTASK_MAX_CONCURRENCY", "32"))
+ATERA_MAX_CONCURRENCY = int(os.getenv("ATERA_MAX_CONCURRENCY", "32"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_COOLDOWN = float(os.getenv("CIRCUIT_COOLDOWN", "30"))
+THRESHOLD_POLL_INTERVAL = float(os.getenv("AUTOTASK_THRESHOLD_POLL_INTERVAL", "60"))
+
+# Autotask slows every request once the hourly quota is half used; stay further below it the higher usage gets
+THRESHOLD_CEILINGS = [(0.9, 0.0), (0.75, 0.25), (0.5, 0.5)]
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Statuses where the server did not act on the request, so even a POST is safe to resend
+NOT_PROCESSED_STATUSES = {429, 503}
+
+_session = None
+_session_lock = threading.Lock()
+_limiters = {}
+_threshold_lock = threading.Lock()
+_threshold_checked = 0.0
+
+def autotask_headers():
+    return {
+        "Content-Type": "application/json",
+        "ApiIntegrationCode": os.getenv("API_INTEGERATION_CODE"),
+        "UserName": os.getenv("USER_NAME"),
+        "Secret": os.getenv("SECRET")
+    }
+
+def atera_headers():
+    return {
+        "X-API-KEY": os.getenv("ATERA_API_KEY"),
+        "Accept": "application/json",
+        "Content-Type": "application/json"
+    }
+
+def host_prefix(api_root):
+    scheme, _, rest = api_root.partition("://")
+    return f"{scheme}://{rest.split('/', 1)[0]}/"
+
+def pool_maxsize(pool_size, maximum):
+    """Connections kept per host: the adaptive limiter may grow to `maximum` in flight, and each one must be reusable."""
+    return max(pool_size, maximum) if ADAPTIVE_CONCURRENCY else pool_size
+
+def get_session():
+    """Returns the process-wide session with a keep-alive pool per API host."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                session.mount(host_prefix(AUTOTASK_API_ROOT), HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize(AUTOTASK_POOL_SIZE, AUTOTASK_MAX_CONCURRENCY)))
+                session.mount(host_prefix(ATERA_API_ROOT), HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize(ATERA_POOL_SIZE, ATERA_MAX_CONCURRENCY)))
+                _session = session
+    return _session
+
+def get_limiter(url):
+    """Returns the adaptive limiter shared by every request to the API host of `url`."""
+    if not ADAPTIVE_CONCURRENCY:
+        return None
+    hosts = (
+        ("Autotask", AUTOTASK_API_ROOT, AUTOTASK_POOL_SIZE, AUTOTASK_MAX_CONCURRENCY),
+        ("Atera", ATERA_API_ROOT, ATERA_POOL_SIZE, ATERA_MAX_CONCURRENCY),
+    )
+    # Match the API root first (Autotask's nextPageUrl may differ in case), then just the host
+    matching = [host for host in hosts if url.lower().startswith(host[1].lower())]
+    matching = matching or [host for host in hosts if url.startswith(host_prefix(host[1]))]
+    if not matching:
+        return None
+    name, _, pool_size, maximum = matching[0]
+    limiter = _limiters.get(name)
+    if limiter is None:
+        with _session_lock:
+            # Start at the connection pool size and grow from there while the server keeps up
+            limiter = _limiters.setdefault(name, AdaptiveLimiter(
+                name, pool_maxsize(pool_size, maximum), initial=pool_size, target_latency=TARGET_LATENCY,
+                failure_threshold=CIRCUIT_FAILURE_THRESHOLD, cooldown=CIRCUIT_COOLDOWN,
+            ))
+    return limiter
+
+def threshold_ceiling(usage, maximum):
+    for level, share in THRESHOLD_CEILINGS:
+        if usage >= level:
+            return max(1, int(maximum * share))
+    return maximum
+
+def check_autotask_threshold(limiter):
+    """Polls ThresholdInformation at most every THRESHOLD_POLL_INTERVAL and caps Autotask concurrency by quota usage."""
+    global _threshold_checked
+    if time.monotonic() - _threshold_checked < THRESHOLD_POLL_INTERVAL or not _threshold_lock.acquire(blocking=False):
+        return
+    try:
+        _threshold_checked = time.monotonic()
+        response = get_session().get(f"{AUTOTASK_API_ROOT}/ThresholdInformation", headers=autotask_headers(), timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+        response.raise_for_status()
+        data = response.json()
+        threshold = data.get("externalRequestThreshold")
+        used = data.get("currentTimeframeRequestCount")
+        if threshold and used is not None:
+            usage = used / threshold
+            logging.info(f"Autotask quota: {used} of {threshold} requests used ({usage:.0%})")
+            limiter.set_ceiling(threshold_ceiling(usage, limiter.maximum))
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logging.warning(f"Could not read Autotask ThresholdInformation: {e}")
+    finally:
+        _threshold_lock.release()
+
+def retry_after_seconds(response):
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+def backoff_seconds(attempt):
+    # Full jitter keeps concurrent workers from retrying in lockstep
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+def request(method, url, idempotent=None, max_retries=MAX_RETRIES, **kwargs):
+    """Sends a request through the shared session, retrying transient failures.
+
+    GETs are retried on connection errors, timeouts and 429/5xx. Other methods
+    are only resent when the request provably never reached the server
+    (connect timeout) or was refused with 429/503, unless `idempotent=True`.
+    """
+    if idempotent is None:
+        idempotent = method.upper() == "GET"
+    kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+    session = get_session()
+    limiter = get_limiter(url)
+    if limiter and limiter.name == "Autotask":
+        check_autotask_threshold(limiter)
+
+    attempt = 0
+    while True:
+        if limiter:
+            limiter.acquire()
+        start = time.monotonic()
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if limiter:
+                limiter.release(failed=True)
+            metrics.observe_request(method, url, time.monotonic() - start, retried=attempt > 0)
+            retryable = idempotent or isinstance(e, requests.exceptions.ConnectTimeout)
+            if not retryable or attempt >= max_retries:
+                # Read by dead_letters when the caller gives up on this request
+                e.attempts = attempt + 1
+                raise
+            delay = backoff_seconds(attempt)
+            logging.warning("%s %s failed (%s). Retrying in %.1fs (%d/%d)", method, url, e, delay, attempt + 1, max_retries)
+        except BaseException:
+            if limiter:
+                limiter.release()
+            raise
+        else:
+            if limiter:
+                limiter.release(time.monotonic() - start, response.status_code)
+            metrics.observe_request(method, url, time.monotonic() - start, response, retried=attempt > 0)
+            status = response.status_code
+            retryable = status in RETRY_STATUSES and (idempotent or status in NOT_PROCESSED_STATUSES)
+            if not retryable or attempt >= max_retries:
+                response.attempts = attempt + 1
+                return response
+            delay = retry_after_seconds(response)
+            if delay is None:
+                delay = backoff_seconds(attempt)
+            logging.warning("%s %s returned %s. Retrying in %.1fs (%d/%d)", method, url, status, delay, attempt + 1, max_retries)
+
+        time.sleep(delay)
+        attempt += 1
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
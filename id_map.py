@@ -0,0 +1,69 @@
+import os
+from checkpoint import AppendLog
+from lookup_index import build_email_index, normalize_email
+
+ID_MAP_FILE = os.path.join("json_files", "id_map.ndjson")
+
+class IdMap(AppendLog):
+    """Persistent map from Autotask IDs to the Atera IDs created for them.
+
+    Keys are (kind, source_id) with kind "contact" (Atera EndUserID),
+    "resource" (Atera technician ID), "ticket" or "note". The contact and
+    resource entries are the identity crosswalk script3 and script4 resolve
+    people through.
+    Lookups hit an in-memory dict. An entry for something just created in
+    Atera is flushed and fsynced right away, so a crash never forgets it and
+    a rerun never creates it twice; entries derived by matching are batched.
+    """
+
+    def __init__(self, path=ID_MAP_FILE, flush_every=100, flush_interval=1.0):
+        super().__init__(path, flush_every=flush_every, flush_interval=flush_interval)
+        self.ids = {}
+        for entry in self.read():
+            self.ids[(entry["kind"], entry["source_id"])] = entry.get("atera_id")
+
+    def has(self, kind, source_id):
+        return (kind, source_id) in self.ids
+
+    def get(self, kind, source_id):
+        return self.ids.get((kind, source_id))
+
+    def record(self, kind, source_id, atera_id, durable=True):
+        if source_id is None:
+            return
+        self.ids[(kind, source_id)] = atera_id
+        self.append({"kind": kind, "source_id": source_id, "atera_id": atera_id})
+        if durable:
+            self.flush()
+
+    def count(self, kind):
+        return sum(1 for key in self.ids if key[0] == kind)
+
+def load_crosswalk(kinds=("contact", "resource"), path=ID_MAP_FILE):
+    """Read-only {kind: {source_id: atera_id}} for the identity kinds, skipping entries without an Atera ID."""
+    crosswalk = {kind: {} for kind in kinds}
+    for entry in AppendLog(path).read():
+        ids = crosswalk.get(entry["kind"])
+        if ids is not None and entry.get("atera_id") is not None:
+            ids[entry["source_id"]] = entry["atera_id"]
+    return crosswalk
+
+def match_by_email(id_map, kind, records, email_key, atera_records, atera_id_key, keep_existing=False):
+    """Records `kind` crosswalk entries for `records` whose email matches one of `atera_records`.
+
+    With `keep_existing`, IDs captured when posting are left as they are and
+    only missing ones are filled in. Returns the number of entries written.
+    """
+    atera_by_email = build_email_index(atera_records, "Email")
+    written = 0
+    for record in records:
+        atera_record = atera_by_email.get(normalize_email(record.get(email_key)))
+        if atera_record is None:
+            continue
+        current = id_map.get(kind, record.get("id"))
+        if current == atera_record.get(atera_id_key) or (keep_existing and current is not None):
+            continue
+        # Rebuilt by matching again if lost, so these are left to the batched flush
+        id_map.record(kind, record.get("id"), atera_record.get(atera_id_key), durable=False)
+        written += 1
+    return written
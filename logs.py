@@ -0,0 +1,87 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_FOLDER = 'log_info'
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+# Overrides the level every script logs at, e.g. DEBUG to see per-request payloads again
+LOG_LEVEL = os.getenv("LOG_LEVEL")
+# Messages below WARNING, per call site: keep only every Nth one (1 = all) ...
+LOG_SAMPLE_EVERY = int(os.getenv("LOG_SAMPLE_EVERY", "1"))
+# ... and at most this many per second (0 = no limit). Warnings and errors are always kept.
+LOG_RATE_LIMIT = float(os.getenv("LOG_RATE_LIMIT", "0"))
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Queues records unformatted, so the message is only built in the writer thread, and only if written."""
+
+    def prepare(self, record):
+        return record
+
+class SuccessSampler(logging.Filter):
+    """Thins out messages below WARNING per call site; warnings and errors always pass.
+
+    Runs before a record is queued. The first message let through after
+    suppressed ones says how many were dropped.
+    """
+
+    def __init__(self, every=LOG_SAMPLE_EVERY, per_second=LOG_RATE_LIMIT):
+        super().__init__()
+        self.every = max(1, every)
+        self.interval = 1.0 / per_second if per_second > 0 else 0.0
+        self.lock = threading.Lock()
+        # (file, line) -> [seen, suppressed since last kept, earliest time the next one may pass]
+        self.sites = {}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or (self.every == 1 and not self.interval):
+            return True
+        now = time.monotonic()
+        with self.lock:
+            site = self.sites.setdefault((record.pathname, record.lineno), [0, 0, 0.0])
+            site[0] += 1
+            if (site[0] - 1) % self.every or now < site[2]:
+                site[1] += 1
+                return False
+            site[2] = now + self.interval
+            suppressed, site[1] = site[1], 0
+        if suppressed:
+            record.msg = f"{record.msg} (+{suppressed} similar suppressed)"
+        return True
+
+def setup(path=None, level=logging.INFO, logger=None, fmt=LOG_FORMAT):
+    """Sends `logger` (the root logger by default) through a queue to a background thread writing `path`.
+
+    Without a path the thread writes to stderr. Like logging.basicConfig, a
+    logger that already has handlers is left alone, so whichever script
+    configures logging first owns it. Returns the logger.
+    """
+    target = logging.getLogger(logger)
+    if target.handlers:
+        return target
+    if path:
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        handler = logging.FileHandler(path)
+    else:
+        handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(fmt))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(SuccessSampler())
+    target.addHandler(queue_handler)
+    target.setLevel(LOG_LEVEL or level)
+
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    # Registered before metrics.start_stage, so it runs after the final metrics message is queued
+    atexit.register(listener.stop)
+    return target
@@ -0,0 +1,99 @@
+import gc
+import json
+import logging
+import marshal
+import os
+import sys
+
+# Bump when the snapshot layout changes; the Python version is part of the key because marshal's format is not stable
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_CACHE = os.getenv("REFERENCE_CACHE", "1") != "0"
+
+def normalize_email(email):
+    if not email:
+        return None
+    return email.strip().lower()
+
+def build_index(records, key, normalize=None):
+    """Builds a hash index over records, keeping the first record for each key."""
+    index = {}
+    for record in records:
+        value = record.get(key)
+        if normalize:
+            value = normalize(value)
+        if value is not None and value not in index:
+            index[value] = record
+    return index
+
+def build_email_index(records, key):
+    return build_index(records, key, normalize=normalize_email)
+
+def snapshot_path(path, key):
+    return f"{path}.{key}.idx"
+
+def snapshot_header(path, key, email, fields=None):
+    stat = os.stat(path)
+    return {
+        "format": SNAPSHOT_FORMAT,
+        "python": list(sys.version_info[:2]),
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "key": key,
+        "email": email,
+        "fields": list(fields) if fields else None,
+    }
+
+def load_snapshot(cache_path, header):
+    """Returns the index stored in `cache_path` if it was built from the current source, else None."""
+    with open(cache_path, "rb") as f:
+        if json.loads(f.readline()) != header:
+            return None
+        data = f.read()
+    # Unmarshalling allocates hundreds of thousands of containers; collector passes would only slow it down
+    gc.disable()
+    try:
+        return marshal.loads(data)
+    finally:
+        gc.enable()
+
+def load_index(path, key, email=False, record_type=None):
+    """Loads the index over the JSON records in `path`, reusing a marshal snapshot of it.
+
+    The snapshot sits next to the source file and is keyed by the source's
+    mtime and size, so it is rebuilt as soon as the JSON file changes. With a
+    `record_type` from projection.py, each record is reduced to that compact type.
+    """
+    fields = record_type.source_keys if record_type else None
+    header = snapshot_header(path, key, email, fields)
+    cache_path = snapshot_path(path, key)
+    if SNAPSHOT_CACHE and os.path.exists(cache_path):
+        try:
+            index = load_snapshot(cache_path, header)
+            if index is not None:
+                return as_records(index, record_type)
+        except (EOFError, ValueError, TypeError, OSError) as e:
+            logging.warning(f"Ignoring unreadable index snapshot {cache_path}: {e}")
+
+    with open(path, "r") as f:
+        records = json.load(f)
+    index = build_email_index(records, key) if email else build_index(records, key)
+    if fields:
+        # Plain tuples in the snapshot: marshal only handles built-in types
+        index = {value: tuple(record.get(field) for field in fields) for value, record in index.items()}
+
+    if SNAPSHOT_CACHE:
+        temp_path = cache_path + ".tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(json.dumps(header).encode() + b"\n")
+                f.write(marshal.dumps(index))
+            os.replace(temp_path, cache_path)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not save index snapshot {cache_path}: {e}")
+    return as_records(index, record_type)
+
+def as_records(index, record_type):
+    if record_type is None:
+        return index
+    make = record_type._make
+    return {value: make(row) for value, row in index.items()}
@@ -0,0 +1,225 @@
+import atexit
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from dotenv import load_dotenv
+
+load_dotenv()
+
+METRICS_FOLDER = os.path.join("json_files", "metrics")
+# Seconds between live progress lines on stderr (0 = off)
+PROGRESS_INTERVAL = float(os.getenv("METRICS_PROGRESS_INTERVAL", "0"))
+
+# Geometric latency buckets from 1ms to ~5min, 20% apart, so quantiles are within a few percent
+BUCKETS = [0.001 * 1.2 ** i for i in range(70)]
+
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+def format_duration(seconds):
+    """HH:MM:SS, prefixed with whole days once it reaches a day (time.strftime alone wraps at 24h)."""
+    days, rest = divmod(int(seconds), 86400)
+    clock = time.strftime("%H:%M:%S", time.gmtime(rest))
+    return f"{days}d {clock}" if days else clock
+
+def endpoint_name(method, url):
+    """Groups URLs by endpoint: host and query string dropped, numeric ids replaced by {id}."""
+    path = url.split("?", 1)[0].split("://", 1)[-1]
+    path = path.split("/", 1)[1] if "/" in path else ""
+    for prefix in ("ATServicesRest/V1.0/", "api/v3/"):
+        if path.startswith(prefix):
+            path = path[len(prefix):]
+    return f"{method.upper()} {_ID_SEGMENT.sub('/{id}', '/' + path)}"
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.total += 1
+        self.sum += value
+
+    def quantile(self, q):
+        if not self.total:
+            return None
+        rank = q * self.total
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return round(BUCKETS[min(index, len(BUCKETS) - 1)], 6)
+
+class EndpointStats:
+    def __init__(self):
+        self.latency = Histogram()
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.throttled = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.statuses = Counter()
+
+    def as_dict(self):
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "statuses": {str(status): count for status, count in sorted(self.statuses.items())},
+            "latency_seconds": {
+                "mean": round(self.latency.sum / self.latency.total, 6) if self.latency.total else None,
+                "p50": self.latency.quantile(0.50),
+                "p95": self.latency.quantile(0.95),
+                "p99": self.latency.quantile(0.99),
+            },
+        }
+
+class Metrics:
+    """Per-process metrics for one stage: HTTP stats per endpoint and records processed."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stage = None
+        self.started = time.monotonic()
+        self.endpoints = {}
+        self.records = 0
+        self.expected = None
+        self.progress_thread = None
+
+    def endpoint(self, method, url):
+        name = endpoint_name(method, url)
+        stats = self.endpoints.get(name)
+        if stats is None:
+            stats = self.endpoints.setdefault(name, EndpointStats())
+        return stats
+
+    def observe_request(self, method, url, seconds, response=None, retried=False):
+        """Records one HTTP attempt; `response` is None when it raised before a status came back."""
+        with self.lock:
+            stats = self.endpoint(method, url)
+            stats.requests += 1
+            stats.latency.observe(seconds)
+            if retried:
+                stats.retries += 1
+            if response is None:
+                stats.errors += 1
+                return
+            stats.statuses[response.status_code] += 1
+            if response.status_code == 429:
+                stats.throttled += 1
+            body = response.request.body if response.request is not None else None
+            stats.bytes_sent += len(body) if body else 0
+            stats.bytes_received += len(response.content or b"")
+
+    def add_records(self, count=1):
+        with self.lock:
+            self.records += count
+
+    def expect_records(self, total):
+        self.expected = total
+
+    def snapshot(self):
+        with self.lock:
+            elapsed = time.monotonic() - self.started
+            return {
+                "stage": self.stage,
+                "elapsed_seconds": round(elapsed, 3),
+                "records": self.records,
+                "records_per_second": round(self.records / elapsed, 3) if elapsed else None,
+                "endpoints": {name: stats.as_dict() for name, stats in sorted(self.endpoints.items())},
+            }
+
+    def prometheus(self):
+        """Renders the snapshot in the Prometheus text exposition format."""
+        stage = self.stage or "unknown"
+        lines = [
+            "# TYPE migration_records_total counter",
+            f'migration_records_total{{stage="{stage}"}} {self.records}',
+            "# TYPE migration_elapsed_seconds gauge",
+            f'migration_elapsed_seconds{{stage="{stage}"}} {time.monotonic() - self.started:.3f}',
+        ]
+        counters = ("requests", "errors", "retries", "throttled", "bytes_sent", "bytes_received")
+        with self.lock:
+            endpoints = sorted(self.endpoints.items())
+            for counter in counters:
+                lines.append(f"# TYPE migration_http_{counter}_total counter")
+                for name, stats in endpoints:
+                    lines.append(f'migration_http_{counter}_total{{stage="{stage}",endpoint="{name}"}} {getattr(stats, counter)}')
+            lines.append("# TYPE migration_http_responses_total counter")
+            for name, stats in endpoints:
+                for status, count in sorted(stats.statuses.items()):
+                    lines.append(f'migration_http_responses_total{{stage="{stage}",endpoint="{name}",status="{status}"}} {count}')
+            lines.append("# TYPE migration_http_latency_seconds histogram")
+            for name, stats in endpoints:
+                labels = f'stage="{stage}",endpoint="{name}"'
+                cumulative = 0
+                for bound, count in zip(BUCKETS, stats.latency.counts):
+                    cumulative += count
+                    lines.append(f'migration_http_latency_seconds_bucket{{{labels},le="{bound:.6g}"}} {cumulative}')
+                lines.append(f'migration_http_latency_seconds_bucket{{{labels},le="+Inf"}} {stats.latency.total}')
+                lines.append(f"migration_http_latency_seconds_sum{{{labels}}} {stats.latency.sum:.6f}")
+                lines.append(f"migration_http_latency_seconds_count{{{labels}}} {stats.latency.total}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, folder=METRICS_FOLDER):
+        """Writes <stage>.json and <stage>.prom into `folder`."""
+        if self.progress_thread:
+            sys.stderr.write("\r" + self.progress_line() + "\033[K\n")
+        os.makedirs(folder, exist_ok=True)
+        base = os.path.join(folder, self.stage or "metrics")
+        with open(base + ".json", "w") as f:
+            json.dump(self.snapshot(), f, indent=4)
+        with open(base + ".prom", "w") as f:
+            f.write(self.prometheus())
+        logging.info(f"Metrics saved to '{base}.json' and '{base}.prom'.")
+
+    def progress_line(self):
+        elapsed = time.monotonic() - self.started
+        rate = self.records / elapsed if elapsed else 0.0
+        line = f"{self.stage}: {self.records} records, {rate:.1f}/s"
+        if self.expected:
+            remaining = max(0, self.expected - self.records)
+            eta = remaining / rate if rate else None
+            line += f", {self.records * 100 / self.expected:.1f}% of {self.expected}"
+            line += f", ETA {format_duration(eta)}" if eta is not None else ", ETA --:--:--"
+        return line
+
+    def show_progress(self, interval):
+        def run():
+            while True:
+                time.sleep(interval)
+                sys.stderr.write("\r" + self.progress_line() + "\033[K")
+                sys.stderr.flush()
+
+        self.progress_thread = threading.Thread(target=run, daemon=True)
+        self.progress_thread.start()
+
+METRICS = Metrics()
+
+def start_stage(stage, progress_interval=PROGRESS_INTERVAL):
+    """Names this process's stage and exports its metrics when the process exits."""
+    METRICS.stage = stage
+    METRICS.started = time.monotonic()
+    atexit.register(METRICS.export)
+    if progress_interval > 0:
+        METRICS.show_progress(progress_interval)
+
+def observe_request(method, url, seconds, response=None, retried=False):
+    METRICS.observe_request(method, url, seconds, response, retried)
+
+def add_records(count=1):
+    METRICS.add_records(count)
+
+def expect_records(total):
+    METRICS.expect_records(total)
@@ -0,0 +1,264 @@
+import argparse
+import json
+import logging
+import logs
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dotenv import load_dotenv
+import staging
+from artifacts import JSON_FOLDER, find_artifact, use_staging
+from checkpoint import CHECKPOINT_FOLDER, AppendLog
+from metrics import format_duration
+
+load_dotenv()
+
+logs.setup(os.path.join(logs.LOG_FOLDER, 'migrate.log'))
+
+SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+STATE_FILE = os.path.join(CHECKPOINT_FOLDER, "migrate_state.json")
+
+# Each stage: script, upstream stages, reference files it reads, files and artifacts it writes,
+# command-line flags it understands and the ledger that says whether its run finished.
+# "after" orders a stage behind others only when those are selected too; "optional" stages only run when named.
+STAGES = {
+    "contacts_migration": {
+        "deps": [],
+        "outputs": ["all_contacts.json"],
+        "flags": ["--delta"],
+    },
+    "fetch_atera_contacts": {
+        "deps": ["contacts_migration"],
+        "outputs": ["atera_contacts.json"],
+        # Contacts resolve through the crosswalk contacts_migration builds; this refetch only reconciles it
+        "optional": True,
+    },
+    "fetch_resources": {
+        "deps": [],
+        "outputs": ["all_resources.json"],
+    },
+    "script1_tickets": {
+        "deps": [],
+        "artifacts": ["result1"],
+        "flags": ["--resume", "--delta"],
+        "ledger": "script1_tickets",
+        "delta_ledger": "script1_tickets_delta",
+    },
+    "script2_tickets": {
+        "deps": ["script1_tickets"],
+        "artifacts": ["result2"],
+        "flags": ["--resume", "--delta"],
+        "ledger": "script2_tickets",
+        "delta_ledger": "script2_tickets_delta",
+    },
+    "script3_tickets": {
+        "deps": ["script2_tickets", "contacts_migration", "fetch_resources"],
+        "after": ["fetch_atera_contacts"],
+        "inputs": ["all_priority.json", "all_status.json", "atera_technicians.json"],
+        "artifacts": ["result3"],
+        "flags": ["--delta"],
+    },
+    "script4_tickets": {
+        "deps": ["script3_tickets"],
+        "flags": ["--resume", "--delta"],
+    },
+}
+
+GROUPS = {
+    "contacts": ["contacts_migration"],
+    "reconcile": ["fetch_atera_contacts"],
+    "resources": ["fetch_resources"],
+    "tickets": ["script1_tickets", "script2_tickets", "script3_tickets", "script4_tickets"],
+}
+
+def load_state():
+    if not os.path.exists(STATE_FILE):
+        return {}
+    with open(STATE_FILE, "r") as f:
+        return json.load(f)
+
+def save_state(state):
+    os.makedirs(os.path.dirname(STATE_FILE), exist_ok=True)
+    temp_file = STATE_FILE + ".tmp"
+    with open(temp_file, "w") as f:
+        json.dump(state, f, indent=4)
+    os.replace(temp_file, STATE_FILE)
+
+def expand(targets):
+    names = []
+    for target in targets:
+        if target not in GROUPS and target not in STAGES:
+            raise ValueError(f"Unknown stage or group '{target}'. Choose from {', '.join(list(GROUPS) + list(STAGES))}")
+        for name in GROUPS.get(target, [target]):
+            if name not in names:
+                names.append(name)
+    return names
+
+def select_stages(targets, only=False):
+    """Returns the stages to run in STAGES order: the targets plus, unless `only`, everything upstream of them."""
+    selected = set(expand(targets or [name for name, stage in STAGES.items() if not stage.get("optional")]))
+    if not only:
+        pending = list(selected)
+        while pending:
+            for dep in STAGES[pending.pop()]["deps"]:
+                if dep not in selected:
+                    selected.add(dep)
+                    pending.append(dep)
+    return [name for name in STAGES if name in selected]
+
+def outputs_exist(stage):
+    if any(not os.path.exists(os.path.join(JSON_FOLDER, name)) for name in stage.get("outputs", [])):
+        return False
+    for name in stage.get("artifacts", []):
+        if use_staging():
+            if not staging.artifact_exists(name):
+                return False
+        else:
+            try:
+                find_artifact(name)
+            except FileNotFoundError:
+                return False
+    return True
+
+def is_up_to_date(name, state):
+    """A stage is current when it finished after every upstream stage and its inputs, and its outputs still exist."""
+    finished = state.get(name)
+    stage = STAGES[name]
+    if finished is None or not outputs_exist(stage):
+        return False
+    if any(state.get(dep) is None or state[dep] > finished for dep in stage["deps"]):
+        return False
+    if any(state.get(dep, 0) > finished for dep in stage.get("after", [])):
+        return False
+    return all(os.path.getmtime(path) <= finished for path in (os.path.join(JSON_FOLDER, name) for name in stage.get("inputs", [])) if os.path.exists(path))
+
+def ledger_complete(ledger):
+    path = os.path.join(CHECKPOINT_FOLDER, f"{ledger}.ledger")
+    return any(entry.get("complete") for entry in AppendLog(path).read())
+
+def run_stage(name, flags):
+    stage = STAGES[name]
+    args = [flag for flag in flags if flag in stage.get("flags", [])]
+    command = [sys.executable, os.path.join(SCRIPT_FOLDER, f"{name}.py")] + args
+    logging.info(f"Starting {name}: {' '.join(command)}")
+    start = time.monotonic()
+    returncode = subprocess.run(command).returncode
+    elapsed = time.monotonic() - start
+
+    if returncode != 0:
+        return "failed", elapsed
+    # script1/2 return normally after failed shards or tickets; only a completed ledger counts as done
+    ledger = stage.get("delta_ledger" if "--delta" in args else "ledger")
+    if ledger and not ledger_complete(ledger):
+        return "incomplete", elapsed
+    return "done", elapsed
+
+def handler(targets=None, only=False, force=False, workers=None, flags=(), dry_run=False):
+    """Runs the selected stages as a dependency graph, independent stages in parallel.
+
+    Returns {stage: (status, seconds)}; status is done, skipped, failed, incomplete or blocked.
+    """
+    names = select_stages(targets, only)
+    state = load_state()
+    # A delta run exists to pick up new changes, so it never counts a stage as current
+    force = force or "--delta" in flags
+    results = {}
+    waiting = list(names)
+    running = {}
+
+    def ready(name):
+        upstream = STAGES[name]["deps"] + STAGES[name].get("after", [])
+        return all(dep in results and results[dep][0] in ("done", "skipped") or dep not in names for dep in upstream)
+
+    def blocked(name):
+        # A selected "after" stage that failed blocks too; otherwise ready() would wait on it forever
+        upstream = STAGES[name]["deps"] + [dep for dep in STAGES[name].get("after", []) if dep in names]
+        return any(dep in results and results[dep][0] not in ("done", "skipped") for dep in upstream)
+
+    with ThreadPoolExecutor(max_workers=workers or len(names) or 1) as executor:
+        while waiting or running:
+            for name in list(waiting):
+                if blocked(name):
+                    waiting.remove(name)
+                    results[name] = ("blocked", 0.0)
+                    logging.warning(f"Skipping {name}: an upstream stage did not finish")
+                elif ready(name):
+                    waiting.remove(name)
+                    if not force and is_up_to_date(name, state):
+                        results[name] = ("skipped", 0.0)
+                        logging.info(f"{name} is up to date")
+                    elif dry_run:
+                        results[name] = ("done", 0.0)
+                        state[name] = time.time()
+                    else:
+                        running[executor.submit(run_stage, name, flags)] = name
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                results[name] = future.result()
+                logging.info(f"{name} {results[name][0]} in {results[name][1]:.1f}s")
+                if results[name][0] == "done":
+                    state[name] = time.time()
+                    save_state(state)
+
+    if dry_run:
+        results = {name: ("would run" if status == "done" else status, seconds) for name, (status, seconds) in results.items()}
+    return {name: results[name] for name in names}
+
+def format_seconds(seconds):
+    if seconds is None:
+        return "unknown"
+    if seconds < 60:
+        return f"{seconds:.1f}s"
+    return format_duration(seconds)
+
+def print_plan(plans, counts, quota):
+    """Prints the planner's per-stage calls, quota share and runtime, then the totals against the hourly threshold."""
+    threshold, used = quota
+    print("Source counts: " + ", ".join(f"{count} {name}" for name, count in counts.items()))
+    width = max(len(name) for name in plans)
+    print(f"{'stage':<{width}}  workers  autotask calls  quota   atera calls  est. time")
+    for name, plan in plans.items():
+        # * marks stages estimated with PLAN_DEFAULT_LATENCY because no earlier run measured their endpoints
+        estimate = format_seconds(plan["seconds"]) + ("" if plan["measured_latency"] else " *")
+        print(f"{name:<{width}}  {plan['concurrency']:>7}  {plan['autotask_calls']:>14}  {plan['quota_share']:>5.0%}  {plan['atera_calls']:>11}  {estimate}")
+    autotask_calls = sum(plan["autotask_calls"] for plan in plans.values())
+    print(f"Autotask: {autotask_calls} requests, {autotask_calls / threshold:.1f} hours of the {threshold}/hour threshold ({used} used this hour).")
+    if used + autotask_calls > threshold / 2:
+        print("Autotask slows requests down once half the hourly threshold is used; spread the fetches or lower their workers.")
+    if not all(plan["measured_latency"] for plan in plans.values()):
+        print("* no measured latency yet (json_files/metrics); assumed PLAN_DEFAULT_LATENCY per request.")
+
+def print_report(results, elapsed):
+    width = max(len(name) for name in results)
+    for name, (status, seconds) in results.items():
+        print(f"{name:<{width}}  {status:<10}  {seconds:8.1f}s")
+    print(f"{'total':<{width}}  {'':<10}  {elapsed:8.1f}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the migration stages as a dependency graph, independent stages in parallel.")
+    parser.add_argument("targets", nargs="*", help=f"Stages or groups to run ({', '.join(GROUPS)}); default is everything")
+    parser.add_argument("--only", action="store_true", help="Run just the targets, without their upstream stages")
+    parser.add_argument("--force", action="store_true", help="Rerun stages even when their outputs are up to date")
+    parser.add_argument("--workers", type=int, default=None, help="Stages run at the same time (default: as many as are ready)")
+    parser.add_argument("--resume", action="store_true", help="Pass --resume to the stages that support it")
+    parser.add_argument("--delta", action="store_true", help="Pass --delta to the stages that support it (implies --force)")
+    parser.add_argument("--dry-run", action="store_true", help="Show which stages would run without running them")
+    parser.add_argument("--plan", action="store_true", help="Predict requests, Autotask quota use and runtime per stage without running them")
+    parser.add_argument("--concurrency", type=int, default=None, help="Request workers per stage to plan for (default: each stage's configured workers)")
+    args = parser.parse_args()
+
+    if args.plan:
+        import planner
+        print_plan(*planner.handler(select_stages(args.targets, args.only), args.concurrency))
+        sys.exit(0)
+
+    flags = [flag for flag, enabled in (("--resume", args.resume), ("--delta", args.delta)) if enabled]
+    start = time.monotonic()
+    results = handler(args.targets, args.only, args.force, args.workers, flags, args.dry_run)
+    print_report(results, time.monotonic() - start)
+    sys.exit(0 if all(status in ("done", "skipped", "would run") for status, _ in results.values()) else 1)
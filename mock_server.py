@@ -0,0 +1,322 @@
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+AUTOTASK_PREFIX = "/ATServicesRest/V1.0/"
+ATERA_PREFIX = "/api/v3/"
+AUTOTASK_PAGE_SIZE = 500
+ATERA_MAX_PAGE_SIZE = 50
+
+OPS = {
+    "eq": lambda value, target: value == target,
+    "noteq": lambda value, target: value != target,
+    "gt": lambda value, target: value is not None and value > target,
+    "gte": lambda value, target: value is not None and value >= target,
+    "lt": lambda value, target: value is not None and value < target,
+    "lte": lambda value, target: value is not None and value <= target,
+    "in": lambda value, target: value in target,
+}
+
+def matches(record, filters):
+    return all(OPS[item["op"]](record.get(item["field"]), item["value"]) for item in filters)
+
+def generate_dataset(tickets, notes_per_ticket=3, contacts=1000, resources=50, seed=0):
+    """Synthetic Autotask entities shaped like the fields the migration scripts read."""
+    rng = random.Random(seed)
+    dataset = {
+        "Contacts": [
+            {
+                "id": 1000 + i,
+                "isActive": int(rng.random() < 0.9),
+                "firstName": "First",
+                "lastName": f"Contact{i}",
+                "emailAddress": f"contact{i}@example.com",
+                "lastModifiedDate": f"2024-01-{1 + i % 28:02d}T00:00:00Z",
+            }
+            for i in range(contacts)
+        ],
+        "Resources": [
+            {"id": 100 + i, "isActive": int(rng.random() < 0.9), "firstName": "First", "lastName": f"Resource{i}", "email": f"resource{i}@example.com"}
+            for i in range(resources)
+        ],
+        "Tickets": [],
+        "TicketNotes": [],
+    }
+    note_ids = itertools.count(1)
+    for i in range(tickets):
+        ticket_id = 10000 + i
+        dataset["Tickets"].append({
+            "id": ticket_id,
+            "title": f"Ticket {i}",
+            "description": "Synthetic ticket",
+            "priority": rng.randint(1, 4),
+            "status": rng.randint(1, 19),
+            "issueType": rng.randint(1, 5),
+            "ticketType": rng.randint(1, 4),
+            "contactID": 1000 + rng.randrange(contacts) if contacts else None,
+            "assignedResourceID": 100 + rng.randrange(resources) if resources else None,
+            "lastActivityDate": f"2024-02-{1 + i % 28:02d}T00:00:00Z",
+        })
+        for n in range(notes_per_ticket):
+            by_resource = rng.random() < 0.5
+            dataset["TicketNotes"].append({
+                "id": next(note_ids),
+                "ticketID": ticket_id,
+                "noteType": 1,
+                "createDateTime": "2024-01-01T00:00:00Z",
+                "description": f"Note {n}",
+                "creatorResourceID": 100 + rng.randrange(resources) if by_resource and resources else None,
+                "createdByContactID": None if by_resource or not contacts else 1000 + rng.randrange(contacts),
+            })
+    return dataset
+
+class MockState:
+    """Data and behaviour shared by all request handler threads."""
+
+    def __init__(self, dataset, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0, retry_after=0, page_size=AUTOTASK_PAGE_SIZE, threshold=10000, seed=0):
+        self.entities = {entity: sorted(records, key=lambda record: record["id"]) for entity, records in dataset.items()}
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.page_size = page_size
+        self.threshold = threshold
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.pages = {}
+        self.tokens = itertools.count(1)
+        self.action_ids = itertools.count(500000)
+        self.atera_contacts = []
+        self.atera_tickets = {}
+        self.requests = 0
+
+    def fault(self):
+        """Returns the status to fail this request with, if any."""
+        with self.lock:
+            self.requests += 1
+            roll = self.rng.random()
+        if roll < self.throttle_rate:
+            return 429
+        if roll < self.throttle_rate + self.error_rate:
+            return 500
+        return None
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(self.latency + self.rng.uniform(0, self.jitter))
+
+    def query(self, base_url, entity, search):
+        rows = [record for record in self.entities.get(entity, []) if matches(record, search.get("filter", []))]
+        if search.get("MaxRecords"):
+            rows = rows[:search["MaxRecords"]]
+        fields = search.get("IncludeFields")
+        if fields:
+            rows = [{field: record.get(field) for field in set(fields) | {"id"}} for record in rows]
+        return self.page(base_url, entity, rows, 0)
+
+    def page(self, base_url, entity, rows, offset):
+        end = offset + self.page_size
+        next_page_url = None
+        if end < len(rows):
+            token = next(self.tokens)
+            with self.lock:
+                self.pages[token] = (rows, end)
+            next_page_url = f"{base_url}{AUTOTASK_PREFIX}{entity}/query/next?paging={token}"
+        return {
+            "items": rows[offset:end],
+            "pageDetails": {"count": len(rows[offset:end]), "requestCount": self.page_size, "prevPageUrl": None, "nextPageUrl": next_page_url},
+        }
+
+    def next_page(self, base_url, entity, token):
+        with self.lock:
+            rows, offset = self.pages.pop(token)
+        return self.page(base_url, entity, rows, offset)
+
+    def create_contact(self, contact):
+        with self.lock:
+            contact_id = next(self.action_ids)
+            self.atera_contacts.append(dict(contact, EndUserID=contact_id))
+        return {"ActionID": contact_id}
+
+    def create_ticket(self, ticket):
+        with self.lock:
+            ticket_id = next(self.action_ids)
+            self.atera_tickets[ticket_id] = dict(ticket, comments=[])
+        return {"ActionID": ticket_id}
+
+    def add_comment(self, ticket_id, comment):
+        with self.lock:
+            ticket = self.atera_tickets.get(ticket_id)
+            if ticket is None:
+                return None
+            ticket["comments"].append(comment)
+        return {"ActionID": ticket_id}
+
+    def list_contacts(self, base_url, page, items_in_page):
+        with self.lock:
+            contacts = list(self.atera_contacts)
+        items_in_page = max(1, min(items_in_page, ATERA_MAX_PAGE_SIZE))
+        total_pages = max(1, -(-len(contacts) // items_in_page))
+        start = (page - 1) * items_in_page
+        link = f"{base_url}{ATERA_PREFIX}contacts?page={{}}&itemsInPage={items_in_page}"
+        return {
+            "items": contacts[start:start + items_in_page],
+            "totalItemCount": len(contacts),
+            "page": page,
+            "itemsInPage": items_in_page,
+            "totalPages": total_pages,
+            "prevLink": link.format(page - 1) if page > 1 else "",
+            "nextLink": link.format(page + 1) if page < total_pages else "",
+        }
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Without TCP_NODELAY, Nagle plus delayed ACKs add ~40ms to every keep-alive response
+    disable_nagle_algorithm = True
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def base_url(self):
+        return f"http://{self.headers.get('Host')}"
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def handle_request(self, method):
+        body = self.read_body()
+        self.state.delay()
+        status = self.state.fault()
+        if status == 429:
+            return self.send_json(429, {"message": "Too many requests"}, {"Retry-After": str(self.state.retry_after)})
+        if status:
+            return self.send_json(status, {"message": "Injected failure"})
+
+        url = urlparse(self.path)
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+        if url.path.startswith(AUTOTASK_PREFIX):
+            result = self.autotask(method, url.path[len(AUTOTASK_PREFIX):].split("/"), params, body)
+        elif url.path.startswith(ATERA_PREFIX):
+            result = self.atera(method, url.path[len(ATERA_PREFIX):].split("/"), params, body)
+        else:
+            result = None
+        if result is None:
+            return self.send_json(404, {"message": f"No mock for {method} {url.path}"})
+        self.send_json(200, result)
+
+    def autotask(self, method, parts, params, body):
+        if parts == ["ThresholdInformation"]:
+            return {"externalRequestThreshold": self.state.threshold, "requestThresholdTimeframe": 60, "currentTimeframeRequestCount": self.state.requests}
+        if parts[1:] == ["entityInformation", "fields"] and parts[0] == "Tickets":
+            return {"fields": [
+                {"name": "priority", "isPickList": True, "picklistValues": [{"value": str(i), "label": f"P{i}", "isActive": True} for i in range(1, 5)]},
+                {"name": "status", "isPickList": True, "picklistValues": [{"value": str(i), "label": f"S{i}", "isActive": True} for i in range(1, 20)]},
+            ]}
+        if len(parts) < 2 or parts[1] != "query":
+            return None
+        entity = parts[0]
+        if parts[2:] == ["next"]:
+            return self.state.next_page(self.base_url(), entity, int(params["paging"]))
+        search = json.loads(params["search"]) if method == "GET" else body
+        if parts[2:] == ["count"]:
+            rows = [record for record in self.state.entities.get(entity, []) if matches(record, search.get("filter", []))]
+            return {"queryCount": len(rows)}
+        return self.state.query(self.base_url(), entity, search)
+
+    def atera(self, method, parts, params, body):
+        if parts == ["contacts"]:
+            if method == "POST":
+                return self.state.create_contact(body)
+            return self.state.list_contacts(self.base_url(), int(params.get("page", 1)), int(params.get("itemsInPage", 20)))
+        if parts == ["tickets"] and method == "POST":
+            return self.state.create_ticket(body)
+        if len(parts) == 3 and parts[0] == "tickets" and parts[2] == "comments" and method == "POST":
+            return self.state.add_comment(int(parts[1]), body)
+        return None
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+class MockServer:
+    """Local stand-in for the Autotask and Atera APIs, served from a background thread.
+
+    Point AUTOTASK_API_ROOT at `autotask_root` and ATERA_API_ROOT at `atera_root`.
+    """
+
+    def __init__(self, dataset, host="127.0.0.1", port=0, **options):
+        self.state = MockState(dataset, **options)
+        handler = type("BoundMockHandler", (MockHandler,), {"state": self.state})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def autotask_root(self):
+        return self.url + AUTOTASK_PREFIX.rstrip("/")
+
+    @property
+    def atera_root(self):
+        return self.url + ATERA_PREFIX.rstrip("/")
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve synthetic Autotask and Atera APIs locally.")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--tickets", type=int, default=1000)
+    parser.add_argument("--notes", type=int, default=3, help="Notes per ticket")
+    parser.add_argument("--contacts", type=int, default=1000)
+    parser.add_argument("--resources", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random extra seconds, up to this much")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    args = parser.parse_args()
+
+    dataset = generate_dataset(args.tickets, args.notes, args.contacts, args.resources)
+    server = MockServer(dataset, port=args.port, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, throttle_rate=args.throttle_rate)
+    print(f"AUTOTASK_API_ROOT={server.autotask_root}")
+    print(f"ATERA_API_ROOT={server.atera_root}")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        server.server.server_close()
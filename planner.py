@@ -0,0 +1,198 @@
+import glob
+import json
+import logging
+import math
+import os
+import requests
+from dotenv import load_dotenv
+import http_client
+from http_client import AUTOTASK_API_ROOT, autotask_headers
+from autotask_query import ALL_IDS, FETCH_WORKERS, ID_SHARDS, count_records
+from metrics import METRICS_FOLDER
+from id_map import IdMap
+
+load_dotenv()
+
+# Autotask query pages hold at most 500 records
+AUTOTASK_PAGE_SIZE = 500
+# Seconds per request assumed for endpoints no earlier run has measured
+PLAN_DEFAULT_LATENCY = float(os.getenv("PLAN_DEFAULT_LATENCY", "0.5"))
+# Hourly request threshold assumed when ThresholdInformation cannot be read
+AUTOTASK_HOURLY_THRESHOLD = int(os.getenv("AUTOTASK_HOURLY_THRESHOLD", "10000"))
+
+def count_source():
+    """Record counts from the Autotask /query/count endpoints; script3 only turns noteType 1 notes into comments."""
+    return {
+        "contacts": count_records("Contacts", ALL_IDS),
+        "resources": count_records("Resources", ALL_IDS),
+        "tickets": count_records("Tickets", ALL_IDS),
+        "notes": count_records("TicketNotes", ALL_IDS),
+        "comments": count_records("TicketNotes", [{"op": "eq", "field": "noteType", "value": 1}]),
+    }
+
+def read_threshold():
+    """Returns (hourly threshold, requests used in the current hour); the default and 0 if it cannot be read."""
+    try:
+        response = http_client.get(f"{AUTOTASK_API_ROOT}/ThresholdInformation", headers=autotask_headers())
+        response.raise_for_status()
+        data = response.json()
+        return data.get("externalRequestThreshold") or AUTOTASK_HOURLY_THRESHOLD, data.get("currentTimeframeRequestCount") or 0
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logging.warning(f"Could not read Autotask ThresholdInformation ({e}); assuming {AUTOTASK_HOURLY_THRESHOLD} requests per hour.")
+        return AUTOTASK_HOURLY_THRESHOLD, 0
+
+class Latencies:
+    """Mean request latency per endpoint, pooled over every stage's exported metrics.
+
+    Records per second are kept per stage for stages that make no requests.
+    """
+
+    def __init__(self, folder=METRICS_FOLDER, default=PLAN_DEFAULT_LATENCY):
+        self.default = default
+        self.endpoints = {}
+        self.rates = {}
+        totals = {}
+        for path in glob.glob(os.path.join(folder, "*.json")):
+            try:
+                with open(path, "r") as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if snapshot.get("records_per_second"):
+                self.rates[snapshot.get("stage")] = snapshot["records_per_second"]
+            for name, stats in snapshot.get("endpoints", {}).items():
+                mean = stats.get("latency_seconds", {}).get("mean")
+                if mean is not None and stats.get("requests"):
+                    count, seconds = totals.get(name, (0, 0.0))
+                    totals[name] = (count + stats["requests"], seconds + mean * stats["requests"])
+        self.endpoints = {name: seconds / count for name, (count, seconds) in totals.items()}
+
+    def get(self, endpoint):
+        """Returns (seconds, measured); paging URLs (.../query/next) share the latency of their query."""
+        for name in (endpoint, endpoint + "/next", endpoint.replace("POST ", "GET ") + "/next"):
+            if name in self.endpoints:
+                return self.endpoints[name], True
+        return self.default, False
+
+def query_pages(records, shards):
+    """Autotask requests to page through `records` split evenly over `shards`; each shard takes at least one."""
+    return shards * max(1, math.ceil(records / shards / AUTOTASK_PAGE_SIZE))
+
+def id_range_probes(records, id_shards):
+    """The first_id call plus the exponential and binary /query/count probes of last_id."""
+    return 1 + 2 * math.ceil(math.log2(max(2, records))) if id_shards > 1 else 0
+
+class StagePlan:
+    """Requests, quota share and runtime predicted for one stage."""
+
+    def __init__(self, name, concurrency):
+        self.name = name
+        self.concurrency = concurrency
+        self.autotask_calls = 0
+        self.atera_calls = 0
+        self.seconds = 0.0
+        self.measured = True
+
+    def calls(self, endpoint, count, latencies, concurrency=None, rate=None, host="autotask"):
+        """Adds `count` sequential-per-worker requests; returns the seconds they take at the given concurrency and rate."""
+        if host == "autotask":
+            self.autotask_calls += count
+        else:
+            self.atera_calls += count
+        latency, measured = latencies.get(endpoint)
+        self.measured = self.measured and (measured or not count)
+        seconds = count * latency / max(1, concurrency or self.concurrency)
+        if rate:
+            seconds = max(seconds, count / rate)
+        return seconds
+
+    def as_dict(self, threshold):
+        return {
+            "concurrency": self.concurrency,
+            "autotask_calls": self.autotask_calls,
+            "atera_calls": self.atera_calls,
+            "quota_share": round(self.autotask_calls / threshold, 3),
+            "seconds": round(self.seconds, 1) if self.seconds is not None else None,
+            "measured_latency": self.measured,
+        }
+
+def plan_fetch(plan, entity, records, values, latencies, id_shards, workers):
+    shards = values * max(1, id_shards)
+    seconds = plan.calls(f"GET /{entity}/query/count", id_range_probes(records, id_shards), latencies, concurrency=1)
+    # Shards page concurrently, but each shard's nextPageUrl chain is sequential
+    return seconds + plan.calls(f"GET /{entity}/query", query_pages(records, shards), latencies, concurrency=min(workers, shards))
+
+def plan_stage(name, counts, migrated, latencies, concurrency=None, id_shards=ID_SHARDS):
+    """Predicts one stage from the source counts; `concurrency` overrides the stage's configured workers."""
+    if name == "contacts_migration":
+        from contacts_migration import UPLOAD_WORKERS
+        plan = StagePlan(name, concurrency or UPLOAD_WORKERS)
+        fetch = plan_fetch(plan, "Contacts", counts["contacts"], 2, latencies, id_shards, concurrency or FETCH_WORKERS)
+        # The upload pool drains the queue while Autotask pages come in, so the slower side sets the pace
+        plan.seconds = max(fetch, plan.calls("POST /contacts", max(0, counts["contacts"] - migrated["contact"]), latencies, host="atera"))
+    elif name == "fetch_atera_contacts":
+        from fetch_atera_contacts import ATERA_PAGE_SIZE, FETCH_WORKERS as ATERA_FETCH_WORKERS
+        plan = StagePlan(name, concurrency or ATERA_FETCH_WORKERS)
+        # Atera holds about as many contacts as contacts_migration uploads
+        plan.seconds = plan.calls("GET /contacts", math.ceil(counts["contacts"] / ATERA_PAGE_SIZE) or 1, latencies, host="atera")
+    elif name == "fetch_resources":
+        plan = StagePlan(name, concurrency or FETCH_WORKERS)
+        plan.seconds = plan_fetch(plan, "Resources", counts["resources"], 2, latencies, id_shards, plan.concurrency)
+    elif name == "script1_tickets":
+        from script1_tickets import PRIORITIES
+        plan = StagePlan(name, concurrency or FETCH_WORKERS)
+        plan.seconds = plan_fetch(plan, "Tickets", counts["tickets"], len(PRIORITIES), latencies, id_shards, plan.concurrency)
+    elif name == "script2_tickets":
+        from script2_tickets import NOTES_BATCH_SIZE, NOTES_MAX_IN_FLIGHT, NOTES_REQUESTS_PER_SECOND, NOTES_WORKERS
+        workers = concurrency or NOTES_WORKERS
+        plan = StagePlan(name, min(workers, NOTES_MAX_IN_FLIGHT or workers))
+        if NOTES_BATCH_SIZE > 0:
+            batches = math.ceil(counts["tickets"] / NOTES_BATCH_SIZE)
+            notes_per_batch = counts["notes"] / batches if batches else 0
+            requests_needed = batches * max(1, math.ceil(notes_per_batch / AUTOTASK_PAGE_SIZE))
+        else:
+            requests_needed = counts["tickets"]
+        plan.seconds = plan.calls("POST /TicketNotes/query", requests_needed, latencies, rate=NOTES_REQUESTS_PER_SECOND)
+    elif name == "script3_tickets":
+        from script3_tickets import MAPPING_WORKERS
+        plan = StagePlan(name, concurrency or MAPPING_WORKERS)
+        # No requests; the mapping rate of an earlier run is the best guide
+        rate = latencies.rates.get(name)
+        plan.seconds = counts["tickets"] / rate if rate else None
+        plan.measured = bool(rate)
+    elif name == "script4_tickets":
+        from script4_tickets import POST_WORKERS
+        plan = StagePlan(name, concurrency or POST_WORKERS)
+        plan.seconds = plan.calls("POST /tickets", max(0, counts["tickets"] - migrated["ticket"]), latencies, host="atera")
+        plan.seconds += plan.calls("POST /tickets/{id}/comments", max(0, counts["comments"] - migrated["note"]), latencies, host="atera")
+    else:
+        raise ValueError(f"No plan model for stage '{name}'")
+    return plan
+
+def quota_floor(calls, threshold, used):
+    """Seconds a stage must at least span so its Autotask calls fit the hourly threshold (0 if they fit now)."""
+    over = calls - max(0, threshold - used)
+    return 3600.0 * math.ceil(over / threshold) if over > 0 else 0.0
+
+def handler(names, concurrency=None):
+    """Returns ({stage: plan dict}, source counts, (threshold, used this hour)) for the stages in `names`.
+
+    Stages are planned one after another, each starting where the previous
+    one left the hourly quota.
+    """
+    counts = count_source()
+    threshold, used = read_threshold()
+    quota = (threshold, used)
+    latencies = Latencies()
+    with IdMap() as id_map:
+        migrated = {kind: id_map.count(kind) for kind in ("contact", "ticket", "note")}
+
+    plans = {}
+    for name in names:
+        plan = plan_stage(name, counts, migrated, latencies, concurrency)
+        if plan.seconds is not None:
+            # Once the hour's threshold is used up Autotask refuses requests until the window moves on
+            plan.seconds = max(plan.seconds, quota_floor(plan.autotask_calls, threshold, used))
+        used += plan.autotask_calls
+        plans[name] = plan.as_dict(threshold)
+    return plans, counts, quota
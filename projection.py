@@ -0,0 +1,49 @@
+import os
+from collections import namedtuple
+
+# Ask Autotask for just the fields below (0 fetches every field, UDFs included)
+FIELD_PROJECTION = os.getenv("FIELD_PROJECTION", "1") != "0"
+
+def compact_type(name, fields):
+    """Declares a namedtuple over `fields`; use (attribute, source key) where the JSON key is not an identifier."""
+    pairs = [field if isinstance(field, tuple) else (field, field) for field in fields]
+    record_type = namedtuple(name, [attribute for attribute, _ in pairs])
+    record_type.source_keys = tuple(source for _, source in pairs)
+    return record_type
+
+def compact(record_type, record):
+    return record_type._make(record.get(key) for key in record_type.source_keys)
+
+# Reference records as script3_tickets reads them
+Named = compact_type("Named", ["id", "name"])
+Contact = compact_type("Contact", ["id", "firstName", "lastName", "emailAddress"])
+Resource = compact_type("Resource", ["id", "firstName", "lastName", "email"])
+# "$id" in atera_technicians.json is a Json.NET reference number; the technician ID is ContactID
+Technician = compact_type("Technician", [("id", "ContactID"), "Email"])
+AteraContact = compact_type("AteraContact", ["EndUserID", "Email"])
+
+# Fields create_ticket_payload reads, plus the delta watermark
+TICKET_FIELDS = [
+    "id", "title", "description", "priority", "status", "issueType", "ticketType",
+    "contactID", "assignedResourceID", "lastActivityDate",
+]
+# Fields get_ticket_comments reads, plus ticketID to group batched results
+NOTE_FIELDS = [
+    "id", "ticketID", "noteType", "createDateTime", "description", "creatorResourceID", "createdByContactID",
+]
+# Contact fields uploaded by contacts_migration and resolved by script3, plus the shard field and watermark
+CONTACT_FIELDS = list(Contact.source_keys) + [
+    "title", "phone", "mobilePhone", "primaryContact", "createDate", "isActive", "lastModifiedDate",
+]
+RESOURCE_FIELDS = list(Resource.source_keys) + ["isActive"]
+
+FIELDS = {
+    "Tickets": TICKET_FIELDS,
+    "TicketNotes": NOTE_FIELDS,
+    "Contacts": CONTACT_FIELDS,
+    "Resources": RESOURCE_FIELDS,
+}
+
+def include_fields(entity):
+    """IncludeFields for an Autotask query on `entity`, or None to fetch whole records."""
+    return FIELDS.get(entity) if FIELD_PROJECTION else None
@@ -0,0 +1,167 @@
+import argparse
+import hashlib
+import json
+import logging
+import logs
+import os
+import time
+import requests
+from dotenv import load_dotenv
+import http_client
+from http_client import AUTOTASK_API_ROOT, atera_headers, autotask_headers
+
+load_dotenv()
+
+REFERENCE_FOLDER = "json_files"
+CACHE_STATE_FILE = os.path.join(REFERENCE_FOLDER, "reference_cache.json")
+# Atera has no documented technicians endpoint; set this to the one the web app uses to fetch them too
+ATERA_TECHNICIANS_URL = os.getenv("ATERA_TECHNICIANS_URL")
+
+DAY = 24 * 60 * 60
+
+# File script3 reads and default time-to-live in seconds, per reference entity
+ENTITIES = {
+    "priorities": ("all_priority.json", 7 * DAY),
+    "statuses": ("all_status.json", 7 * DAY),
+    "technicians": ("atera_technicians.json", DAY),
+    "resources": ("all_resources.json", DAY),
+}
+
+def ttl_seconds(entity):
+    return float(os.getenv(f"REFERENCE_TTL_{entity.upper()}", ENTITIES[entity][1]))
+
+def reference_path(entity):
+    return os.path.join(REFERENCE_FOLDER, ENTITIES[entity][0])
+
+def load_state():
+    if not os.path.exists(CACHE_STATE_FILE):
+        return {}
+    with open(CACHE_STATE_FILE, "r") as f:
+        return json.load(f)
+
+def save_state(state):
+    os.makedirs(REFERENCE_FOLDER, exist_ok=True)
+    temp_file = CACHE_STATE_FILE + ".tmp"
+    with open(temp_file, "w") as f:
+        json.dump(state, f, indent=4)
+    os.replace(temp_file, CACHE_STATE_FILE)
+
+def content_hash(records):
+    return hashlib.sha256(json.dumps(records, sort_keys=True).encode()).hexdigest()
+
+def conditional_get(url, headers, entry):
+    """GETs `url` with the validators saved in `entry`; returns None when the server answers 304 Not Modified."""
+    headers = dict(headers)
+    if entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    response = http_client.get(url, headers=headers)
+    if response.status_code == 304:
+        return None
+    response.raise_for_status()
+    entry["etag"] = response.headers.get("ETag")
+    entry["last_modified"] = response.headers.get("Last-Modified")
+    return response.json()
+
+def picklist(field_name, entry):
+    """Values of a Tickets picklist field, shaped like the hand-saved files ({"id", "name"}).
+
+    Inactive values are kept: historical tickets still use retired priorities and statuses.
+    """
+    data = conditional_get(f"{AUTOTASK_API_ROOT}/Tickets/entityInformation/fields", autotask_headers(), entry)
+    if data is None:
+        return None
+    for field in data.get("fields", []):
+        if field.get("name") == field_name:
+            return [
+                {"id": int(value["value"]), "name": value.get("label")}
+                for value in field.get("picklistValues") or []
+            ]
+    raise ValueError(f"Tickets has no picklist field '{field_name}'")
+
+def fetch_technicians(entry):
+    if not ATERA_TECHNICIANS_URL:
+        raise ValueError("ATERA_TECHNICIANS_URL is not set")
+    data = conditional_get(ATERA_TECHNICIANS_URL, atera_headers(), entry)
+    if data is None:
+        return None
+    return data.get("items", data) if isinstance(data, dict) else data
+
+def fetch_resources(entry):
+    # Imported here: fetch_resources sets up its own log file at import time
+    from fetch_resources import fetch_all_resources
+    return fetch_all_resources()
+
+FETCHERS = {
+    "priorities": lambda entry: picklist("priority", entry),
+    "statuses": lambda entry: picklist("status", entry),
+    "technicians": fetch_technicians,
+    "resources": fetch_resources,
+}
+
+def has_source(entity):
+    """Technicians can only be refetched when ATERA_TECHNICIANS_URL is set; otherwise the hand-saved file is the source."""
+    return entity != "technicians" or bool(ATERA_TECHNICIANS_URL)
+
+def is_fresh(entity, entry):
+    return os.path.exists(reference_path(entity)) and time.time() - entry.get("fetched_at", 0) < ttl_seconds(entity)
+
+def refresh(entity, force=False, fetch=None):
+    """Makes sure the reference file for `entity` is no older than its TTL.
+
+    Returns True when the file changed. A fresh file is served from disk
+    without any request. A stale one is refetched, conditionally where the
+    API supports validators, and only rewritten when its content changed, so
+    index snapshots and stage timestamps built from it stay valid. If the
+    fetch fails, the existing file is kept and used.
+    """
+    state = load_state()
+    entry = state.setdefault(entity, {})
+    path = reference_path(entity)
+    if not force and is_fresh(entity, entry):
+        logging.info(f"Reference data '{entity}' is fresh; using '{path}'.")
+        return False
+    if fetch is None and not has_source(entity) and os.path.exists(path):
+        logging.info(f"No source configured for '{entity}'; using the hand-saved '{path}'.")
+        return False
+
+    try:
+        records = (fetch or FETCHERS[entity])(entry)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        if not os.path.exists(path):
+            raise
+        logging.warning(f"Could not refresh '{entity}' ({e}); keeping '{path}'.")
+        return False
+
+    changed = False
+    if records is None:
+        logging.info(f"Reference data '{entity}' not modified on the server.")
+    elif os.path.exists(path) and entry.get("hash") == content_hash(records):
+        logging.info(f"Reference data '{entity}' unchanged ({len(records)} records).")
+    else:
+        os.makedirs(REFERENCE_FOLDER, exist_ok=True)
+        temp_file = path + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump(records, f, indent=4)
+        os.replace(temp_file, path)
+        entry["hash"] = content_hash(records)
+        changed = True
+        logging.info(f"Saved {len(records)} '{entity}' records to '{path}'.")
+
+    entry["fetched_at"] = time.time()
+    state[entity] = entry
+    save_state(state)
+    return changed
+
+def ensure(entities, force=False):
+    for entity in entities:
+        refresh(entity, force)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh cached reference data whose TTL has expired.")
+    parser.add_argument("entities", nargs="*", default=list(ENTITIES), help=f"Any of {', '.join(ENTITIES)} (default: all)")
+    parser.add_argument("--force", action="store_true", help="Refetch even when the cached copy is fresh")
+    args = parser.parse_args()
+    logs.setup()
+    ensure(args.entities, args.force)
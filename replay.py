@@ -0,0 +1,146 @@
+import argparse
+import json
+import logging
+import logs
+import os
+from collections import Counter
+from functools import partial
+from dotenv import load_dotenv
+import metrics
+import staging
+from artifacts import merge_delta, open_reader, open_writer, use_staging
+from dead_letters import DeadLetters
+from id_map import IdMap
+from workers import RateLimiter, ordered_map
+
+load_dotenv()
+
+# Configured before the stage modules are imported, so their setup calls leave it alone
+logs.setup(os.path.join(logs.LOG_FOLDER, 'replay.log'))
+
+REPLAY_WORKERS = int(os.getenv("REPLAY_WORKERS", "4"))
+
+def load_payloads(entries):
+    """Finds the record behind each dead letter, reading every referenced artifact or file once."""
+    wanted = {}
+    for entry in entries:
+        payload = entry.get("payload") or {}
+        source = (payload.get("artifact"), payload.get("file"), payload.get("key", "id"))
+        wanted.setdefault(source, set()).add(entry["source_id"])
+
+    found = {}
+    for (artifact, path, key), ids in wanted.items():
+        try:
+            if artifact:
+                records = open_reader(artifact)
+            else:
+                with open(path, "r") as f:
+                    records = json.load(f)
+            for record in records:
+                if record.get(key) in ids:
+                    found[record.get(key)] = record
+        except (FileNotFoundError, TypeError) as e:
+            logging.error(f"Payloads for {len(ids)} dead letters are gone ({artifact or path}): {e}")
+    return found
+
+def replay_contacts(items, workers, dead_letters):
+    from contacts_migration import post_to_atera
+    contacts = [record for _, record in items]
+    with IdMap() as id_map:
+        results = ordered_map(partial(post_to_atera, id_map=id_map, dead_letters=dead_letters), contacts, workers)
+        return [(contact.get("id"), ok) for contact, ok in zip(contacts, results)]
+
+def replay_notes(items, workers, dead_letters):
+    """Enriches the tickets again and merges them into result2; rerun script3/script4 for them afterwards."""
+    import script2_tickets as stage
+    tickets = [record for _, record in items]
+    limiter = RateLimiter(stage.NOTES_REQUESTS_PER_SECOND, workers)
+    results = []
+    with open_writer("result2.replay") as writer:
+        enriched = ordered_map(partial(stage.enrich_ticket, limiter=limiter, dead_letters=dead_letters), tickets, workers)
+        for ticket, result in zip(tickets, enriched):
+            if result is not None:
+                writer.write(result)
+            results.append((ticket.get("id"), result is not None))
+    if writer.count:
+        changed, total = merge_delta("result2", suffix=".replay")
+        logging.info(f"Merged {changed} replayed tickets into result2 ({total} tickets).")
+    return results
+
+def replay_mapping(items, workers, dead_letters):
+    """Maps the tickets again (after fixing their reference data) and merges them into result3."""
+    import script3_tickets as stage
+    if use_staging():
+        stage.use_staged_indexes()
+    results = []
+    with open_writer("result3.replay", key="SourceTicketID") as writer:
+        for _, ticket in items:
+            payloads = list(stage.map_tickets([ticket], dead_letters))
+            writer.write_all(payloads)
+            results.append((ticket.get("id"), bool(payloads)))
+    if writer.count:
+        changed, total = merge_delta("result3", key="SourceTicketID", suffix=".replay")
+        logging.info(f"Merged {changed} replayed payloads into result3 ({total} tickets).")
+    return results
+
+def replay_posts(items, workers, dead_letters):
+    """Posts the tickets again; the id map makes sure only what is still missing in Atera is sent."""
+    import script4_tickets as stage
+    staged = use_staging()
+
+    def migrate(item):
+        entry, ticket = item
+        success = stage.migrate_ticket(ticket, id_map=id_map, dead_letters=dead_letters)
+        if success and staged:
+            staging.mark_posted(entry["payload"]["artifact"], ticket.get("SourceTicketID"))
+        return success
+
+    with IdMap() as id_map:
+        return [(entry["source_id"], ok) for (entry, _), ok in zip(items, ordered_map(migrate, items, workers))]
+
+REPLAYERS = {
+    "contacts_migration": replay_contacts,
+    "script2_tickets": replay_notes,
+    "script2_tickets_delta": replay_notes,
+    "script3_tickets": replay_mapping,
+    "script4_tickets": replay_posts,
+}
+
+def summarize(entries):
+    statuses = Counter(str(entry.get("status")) for entry in entries)
+    return ", ".join(f"{count} x {status}" for status, count in statuses.most_common())
+
+def handler(stage, workers=REPLAY_WORKERS, limit=None, list_only=False):
+    """Retries the pending dead letters of `stage` concurrently; returns (recovered, still failing)."""
+    dead_letters = DeadLetters(stage)
+    entries = dead_letters.pending()[:limit]
+    print(f"{stage}: {len(entries)} pending dead letters" + (f" (status: {summarize(entries)})" if entries else ""))
+    if list_only or not entries:
+        return 0, len(entries)
+
+    payloads = load_payloads(entries)
+    items = [(entry, payloads[entry["source_id"]]) for entry in entries if entry["source_id"] in payloads]
+    missing = len(entries) - len(items)
+    logging.info(f"Replaying {len(items)} dead letters of {stage} with {workers} workers")
+
+    recovered = 0
+    with dead_letters:
+        for source_id, ok in REPLAYERS[stage](items, workers, dead_letters):
+            if ok:
+                dead_letters.resolve(source_id)
+                recovered += 1
+            metrics.add_records()
+
+    still_failing = len(items) - recovered
+    print(f"{stage}: {recovered} recovered, {still_failing} failed again, {missing} without a payload to replay.")
+    return recovered, still_failing + missing
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Retry only the items a stage dead-lettered, concurrently.")
+    parser.add_argument("stage", choices=list(REPLAYERS), help="Stage whose dead letters to replay")
+    parser.add_argument("--workers", type=int, default=REPLAY_WORKERS, help="Items replayed concurrently")
+    parser.add_argument("--limit", type=int, default=None, help="Replay at most this many items")
+    parser.add_argument("--list", action="store_true", help="Only show how many items are pending, by HTTP status")
+    args = parser.parse_args()
+    metrics.start_stage(f"replay_{args.stage}")
+    handler(args.stage, args.workers, args.limit, args.list)
@@ -1,93 +1,75 @@
-import requests
-import json
-import time
+import argparse
 import os
 import logging
+import logs
 from dotenv import load_dotenv
+from artifacts import merge_delta, open_writer
+from autotask_query import FETCH_WORKERS, ID_SHARDS, fetch_partitioned, plan_shards
+from checkpoint import ProgressLedger
+import metrics
+from watermarks import WatermarkTracker, delta_filters, get_watermark, save_watermark
 
 load_dotenv()
 
 # Set up logging
-log_folder = 'log_info'
-log_file = os.path.join(log_folder, 'log1.log')
-
-# Create log folder if it doesn't exist
-os.makedirs(log_folder, exist_ok=True)
-
-logging.basicConfig(
-    filename=log_file,
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
-
-BASE_URL = "https://webservices14.autotask.net/ATServicesRest/V1.0/Tickets/query"
-HEADERS = {
-    "ApiIntegrationCode": os.getenv("API_INTEGERATION_CODE"),
-    "UserName": os.getenv("USER_NAME"),
-    "Secret": os.getenv("SECRET")
-}
-
-def fetch_tickets(priority, max_retries=3):
-    all_tickets = []
-    request_count = 0
-    next_page_url = None
-    retries = 0
-
-    search_payload = {
-        "filter": [{"op": "eq", "field": "priority", "value": priority}]
-    }
-
-    while True:
-        url = next_page_url if next_page_url else BASE_URL
-        params = {'search': json.dumps(search_payload)} if not next_page_url else {}
-
-        try:
-            logging.info(f"Fetching tickets for priority {priority} from {url}...")
-            response = requests.get(url, headers=HEADERS, params=params, timeout=60)  # Increased timeout to 60 seconds
-            request_count += 1
-            logging.info(f"Request count for priority {priority}: {request_count}")
-            response.raise_for_status()  # Raise an exception for HTTP errors (4xx, 5xx)
-
-            data = response.json()
-            all_tickets.extend(data.get("items", []))
-
-            next_page_url = data.get("pageDetails", {}).get("nextPageUrl")
-            if not next_page_url:
-                logging.info(f"No more pages for priority {priority}.")
-                break
-
-        except requests.exceptions.Timeout:
-            logging.warning(f"Timeout occurred for priority {priority}. Retrying... ({retries+1}/{max_retries})")
-            retries += 1
-            if retries >= max_retries:
-                logging.error(f"Max retries reached for priority {priority}. Skipping this priority.")
-                break
-            time.sleep(10 * retries)  # Exponential backoff
-
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Request failed for priority {priority}: {str(e)}. Skipping this priority.")
-            break
-
-    logging.info(f"Total tickets fetched for priority {priority}: {len(all_tickets)}")
-    return all_tickets
-
-def handler():
-    all_tickets = []
-
-    for priority in range(1, 5):
-        logging.info(f"Fetching tickets for priority {priority}...")
-        tickets = fetch_tickets(priority)
-        all_tickets.extend(tickets)
-        logging.info(f"Fetched {len(tickets)} tickets for priority {priority}.")
-
-    result_file = os.path.join("json_files", "result1.json")
-    os.makedirs(os.path.dirname(result_file), exist_ok=True)
-    
-    with open(result_file, "w") as f:
-        json.dump(all_tickets, f, indent=4)
-
-    logging.info(f"Total tickets fetched: {len(all_tickets)}")
-    logging.info(f"Data saved to '{result_file}'.")
+logs.setup(os.path.join(logs.LOG_FOLDER, 'log1.log'))
+
+PRIORITIES = [1, 2, 3, 4]
+
+def handler(resume=False, workers=FETCH_WORKERS, id_shards=ID_SHARDS, delta=False):
+    since = get_watermark("Tickets") if delta else None
+    if delta and since is None:
+        logging.warning("No Tickets watermark saved yet; running a full fetch instead of a delta.")
+        delta = False
+
+    # A delta run fetches only tickets changed since the watermark, then merges them into result1
+    result_name = "result1.delta" if delta else "result1"
+    ledger = ProgressLedger("script1_tickets_delta" if delta else "script1_tickets", resume=resume, flush_every=1)
+    if ledger.complete:
+        logging.info(f"Ticket fetch already completed; keeping '{result_name}'.")
+        return
+
+    tracker = WatermarkTracker("Tickets")
+    with open_writer(result_name, resume=resume) as writer, ledger:
+        ledger.before_flush = writer.flush
+        seen_ids = set()
+        for ticket in writer.salvage():
+            seen_ids.add(ticket.get("id"))
+            tracker.observe([ticket])
+        if seen_ids:
+            logging.info(f"Salvaged {len(seen_ids)} tickets from the interrupted run.")
+
+        # Reuse the interrupted run's shards so its saved cursors still line up
+        base_filters = delta_filters("Tickets", since) if delta else None
+        shards = ledger.plan or plan_shards("Tickets", "priority", PRIORITIES, base_filters, id_shards)
+        ledger.save_plan(shards)
+
+        def write_tickets(shard, tickets):
+            writer.write_all(tickets)
+            metrics.add_records(len(tickets))
+            tracker.observe(tickets)
+            logging.info(f"Fetched {len(tickets)} tickets for {shard['key']} ({writer.count} total).")
+
+        completed = fetch_partitioned("Tickets", shards, write_tickets, workers, ledger, seen_ids)
+
+    if completed != len(shards):
+        logging.warning("Some shards failed; rerun with --resume to fetch the rest.")
+        return
+
+    if delta:
+        changed, total = merge_delta("result1")
+        logging.info(f"Merged {changed} changed tickets into result1 ({total} tickets).")
+    save_watermark("Tickets", tracker.value or since)
+    ledger.mark_complete()
+    logging.info(f"Total tickets fetched: {writer.count}")
+    logging.info(f"Data saved to '{writer.path}'.")
 
 if __name__ == "__main__":
-    handler()
+    parser = argparse.ArgumentParser(description="Fetch all Autotask tickets priority wise into result1.")
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted run from its saved page cursors")
+    parser.add_argument("--workers", type=int, default=FETCH_WORKERS, help="Shards fetched concurrently")
+    parser.add_argument("--id-shards", type=int, default=ID_SHARDS, help="Id ranges each priority is split into")
+    parser.add_argument("--delta", action="store_true", help="Fetch only tickets changed since the last run into result1.delta and merge them")
+    args = parser.parse_args()
+    metrics.start_stage("script1_tickets")
+    handler(args.resume, args.workers, args.id_shards, args.delta)
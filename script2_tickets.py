@@ -1,32 +1,34 @@
-import json
+import argparse
 import requests
-from requests.auth import HTTPBasicAuth
 import os
-import time
 import logging
-from tenacity import retry, stop_after_attempt, wait_exponential
+import logs
+from contextlib import nullcontext
+from functools import partial
 from dotenv import load_dotenv
+from workers import RateLimiter, chunked, ordered_map
+import http_client
+from http_client import AUTOTASK_API_ROOT, autotask_headers
+from artifacts import count_artifact, merge_delta, open_reader, open_writer
+import metrics
+from checkpoint import ProgressLedger
+from projection import include_fields
+from dead_letters import DeadLetters, http_attempts
 
 load_dotenv()
 
-log_folder = 'log_info'
-log_file = os.path.join(log_folder, 'log2.log')
+logs.setup(os.path.join(logs.LOG_FOLDER, 'log2.log'))
 
-os.makedirs(log_folder, exist_ok=True)
+API_URL = f"{AUTOTASK_API_ROOT}/TicketNotes/query"
 
-logging.basicConfig(
-    filename=log_file,
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+NOTES_WORKERS = int(os.getenv("NOTES_WORKERS", "1"))
+NOTES_REQUESTS_PER_SECOND = float(os.getenv("NOTES_REQUESTS_PER_SECOND", "2"))
+NOTES_MAX_IN_FLIGHT = int(os.getenv("NOTES_MAX_IN_FLIGHT", "0")) or None
+# Ticket IDs per `in` filter in batched mode (0 keeps one request per ticket); Autotask caps `in` at 500 values
+NOTES_BATCH_SIZE = int(os.getenv("NOTES_BATCH_SIZE", "0"))
 
-API_URL = "https://webservices14.autotask.net/ATServicesRest/V1.0/TicketNotes/query"
-API_INTEGRATION_CODE = os.getenv("API_INTEGERATION_CODE")
-USER_NAME = os.getenv("USER_NAME")
-SECRET = os.getenv("SECRET")
-
-@retry(stop=stop_after_attempt(5), wait=wait_exponential(min=1, max=60))
-def get_ticket_notes(ticket_id):
+# http_client is the only retry layer: it retries timeouts, 429 and 5xx with backoff, and never other 4xx
+def get_ticket_notes(ticket_id, limiter=None):
     search_payload = {
         "filter": [
             {
@@ -36,27 +38,24 @@ def get_ticket_notes(ticket_id):
             }
         ]
     }
+    if include_fields("TicketNotes"):
+        search_payload["IncludeFields"] = include_fields("TicketNotes")
 
-    headers = {
-        "Content-Type": "application/json",
-        "ApiIntegrationCode": API_INTEGRATION_CODE,
-        "UserName": USER_NAME,
-        "Secret": SECRET
-    }
+    headers = autotask_headers()
 
     try:
-        logging.info(f"Sending request for ticket ID {ticket_id}")
-        logging.info(f"Request Payload: {search_payload}")
-        response = requests.post(API_URL, json=search_payload, headers=headers, auth=HTTPBasicAuth(USER_NAME, SECRET), timeout=30)
-        
-        logging.info(f"Response Status Code: {response.status_code}")
-        if response.status_code == 200:
-            response_data = response.json()
-            return response_data.get("items", [])
-        else:
+        # Per-request detail is DEBUG (LOG_LEVEL=DEBUG) and lazily formatted, so it costs next to nothing otherwise
+        logging.debug("Sending request for ticket ID %s with payload %s", ticket_id, search_payload)
+        with limiter or nullcontext():
+            response = http_client.post(API_URL, json=search_payload, headers=headers, idempotent=True)
+
+        logging.debug("Response status code for ticket %s: %s", ticket_id, response.status_code)
+        if response.status_code != 200:
             logging.error(f"Error fetching notes for ticket {ticket_id}: {response.status_code}")
             logging.error(f"Response Body: {response.text}")
-            return []
+            # Raising lets give_up dead-letter it, instead of writing the ticket without notes
+            response.raise_for_status()
+        return response.json().get("items", [])
 
     except requests.exceptions.Timeout as e:
         logging.error(f"Timeout error for ticket {ticket_id}: {e}")
@@ -65,28 +64,166 @@ def get_ticket_notes(ticket_id):
         logging.error(f"Request error for ticket {ticket_id}: {e}")
         raise
 
-def handler(input_file, output_file):
+def query_notes_page(url, search_payload=None, limiter=None):
+    headers = autotask_headers()
+
+    with limiter or nullcontext():
+        if search_payload is not None:
+            response = http_client.post(url, json=search_payload, headers=headers, idempotent=True)
+        else:
+            response = http_client.get(url, headers=headers)
+
+    if response.status_code != 200:
+        logging.error(f"Error fetching notes page {url}: {response.status_code}")
+        logging.error(f"Response Body: {response.text}")
+        response.raise_for_status()
+    return response.json()
+
+def get_ticket_notes_batch(ticket_ids, limiter=None):
+    """Fetches notes for a chunk of tickets with one `in` query, following nextPageUrl paging."""
+    search_payload = {
+        "filter": [
+            {
+                "op": "in",
+                "field": "ticketID",
+                "value": list(ticket_ids)
+            }
+        ]
+    }
+    if include_fields("TicketNotes"):
+        search_payload["IncludeFields"] = include_fields("TicketNotes")
+
+    notes_by_ticket = {ticket_id: [] for ticket_id in ticket_ids}
+    logging.info("Sending batched notes request for %d tickets (%s..%s)", len(ticket_ids), ticket_ids[0], ticket_ids[-1])
+    data = query_notes_page(API_URL, search_payload, limiter)
+    pages = 1
+    while True:
+        for note in data.get("items", []):
+            notes_by_ticket.setdefault(note.get("ticketID"), []).append(note)
+
+        next_page_url = data.get("pageDetails", {}).get("nextPageUrl")
+        if not next_page_url:
+            break
+        data = query_notes_page(next_page_url, limiter=limiter)
+        pages += 1
+
+    logging.info("Fetched notes for %d tickets in %d page(s)", len(ticket_ids), pages)
+    return notes_by_ticket
+
+def give_up(dead_letters, ticket_ids, error):
+    """Dead-letters tickets whose notes could not be fetched once http_client ran out of retries."""
+    logging.error(f"Giving up on notes for {len(ticket_ids)} ticket(s) after {http_attempts(error)} attempts: {error}")
+    if dead_letters is None:
+        raise error
+    for ticket_id in ticket_ids:
+        dead_letters.record(ticket_id, error)
+
+def enrich_ticket_chunk(tickets, limiter=None, dead_letters=None):
+    """Returns the chunk with notes attached, or no tickets if its query failed for good."""
+    ticket_ids = [ticket["id"] for ticket in tickets if ticket.get("id")]
+    if ticket_ids:
+        try:
+            notes_by_ticket = get_ticket_notes_batch(ticket_ids, limiter)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            give_up(dead_letters, ticket_ids, e)
+            return []
+        for ticket in tickets:
+            if ticket.get("id"):
+                ticket["notes"] = notes_by_ticket.get(ticket["id"], [])
+    return tickets
+
+def enrich_ticket(ticket, limiter=None, dead_letters=None):
+    """Returns the ticket with notes attached, or None if its query failed for good."""
+    ticket_id = ticket.get("id")
+    if ticket_id:
+        try:
+            ticket["notes"] = get_ticket_notes(ticket_id, limiter)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            give_up(dead_letters, [ticket_id], e)
+            return None
+    return ticket
+
+def enrich_tickets(all_tickets, workers, limiter, batch_size=0, dead_letters=None):
+    """Enriched tickets in input order; dead-lettered ones are left out rather than ending the run."""
+    if batch_size > 0:
+        for tickets in ordered_map(partial(enrich_ticket_chunk, limiter=limiter, dead_letters=dead_letters), chunked(all_tickets, batch_size), workers):
+            yield from tickets
+    else:
+        for ticket in ordered_map(partial(enrich_ticket, limiter=limiter, dead_letters=dead_letters), all_tickets, workers):
+            if ticket is not None:
+                yield ticket
+
+def resume_tickets(writer, ledger, tickets):
+    """Salvages every enriched ticket of an interrupted run the ledger covers; returns it with the tickets still to enrich.
+
+    The artifact is synced before each ledger flush, so every ticket the
+    ledger marks done has its record in the salvaged output. Salvaged
+    tickets come first, then the rest in input order.
+    """
+    salvaged_ids = set()
+
+    def already_enriched(record):
+        ticket_id = record.get("id")
+        if ticket_id is None or not ledger.is_done(ticket_id) or ticket_id in salvaged_ids:
+            return False
+        salvaged_ids.add(ticket_id)
+        return True
+
+    salvaged = sum(1 for _ in writer.salvage(already_enriched))
+    return salvaged, (ticket for ticket in tickets if ticket.get("id") not in salvaged_ids)
+
+def handler(input_artifact, output_artifact, workers=NOTES_WORKERS, requests_per_second=NOTES_REQUESTS_PER_SECOND, max_in_flight=NOTES_MAX_IN_FLIGHT, batch_size=NOTES_BATCH_SIZE, resume=False, stage="script2_tickets"):
     count = 0
-    with open(input_file, "r") as f:
-        all_tickets = json.load(f)
+    # Small batches: a crash only costs the tickets enriched since the last flush
+    ledger = ProgressLedger(stage, resume=resume, flush_every=50, flush_interval=1.0)
+    if ledger.complete:
+        logging.info(f"Notes enrichment already completed; keeping '{output_artifact}'.")
+        return
+
+    # One limiter for the whole pool, so adding workers never raises the overall request rate
+    limiter = RateLimiter(requests_per_second, max_in_flight or workers)
+    logging.info(f"Enriching tickets from {input_artifact} with {workers} workers at {requests_per_second} requests/second (batch size {batch_size})")
 
-    for ticket in all_tickets:
-        count += 1
-        logging.info(f"Tickets Processed: {count}")
-        ticket_id = ticket.get("id")
-        if ticket_id:
-            ticket_notes = get_ticket_notes(ticket_id)
-            ticket["notes"] = ticket_notes
+    # Failures of an interrupted run stay pending on resume; a fresh run starts a clean list
+    dead_letters = DeadLetters(stage, {"artifact": input_artifact, "key": "id"}, reset=not resume)
 
-        time.sleep(0.5)
+    with open_writer(output_artifact, resume=resume) as writer, ledger, dead_letters:
+        ledger.before_flush = writer.flush
+        tickets = open_reader(input_artifact)
+        if resume:
+            count, tickets = resume_tickets(writer, ledger, tickets)
+            logging.info(f"Salvaged {count} enriched tickets from the interrupted run.")
+        if metrics.PROGRESS_INTERVAL:
+            metrics.expect_records(count_artifact(input_artifact) - count)
 
-    with open(output_file, "w") as f:
-        json.dump(all_tickets, f, indent=4)
+        for ticket in enrich_tickets(tickets, workers, limiter, batch_size, dead_letters):
+            count += 1
+            metrics.add_records()
+            logging.info("Tickets Processed: %d", count)
+            writer.write(ticket)
+            if ticket.get("id"):
+                ledger.mark_done(ticket["id"])
 
-    logging.info(f"Processed {len(all_tickets)} tickets and saved to {output_file}")
+    ledger.mark_complete()
+    logging.info(f"Processed {count} tickets and saved to {writer.path}")
+    if dead_letters.count:
+        logging.error(f"{dead_letters.count} tickets were left out; see '{dead_letters.path}' and run 'python replay.py {stage}'.")
 
 # Entry point
 if __name__ == "__main__":
-    input_file = os.path.join("json_files", "result1.json")
-    output_file = os.path.join("json_files", "result2.json")
-    handler(input_file, output_file)
+    parser = argparse.ArgumentParser(description="Fetch TicketNotes for every ticket in result1.json.")
+    parser.add_argument("--workers", type=int, default=NOTES_WORKERS, help="Concurrent TicketNotes requests")
+    parser.add_argument("--rps", type=float, default=NOTES_REQUESTS_PER_SECOND, help="Global requests per second across all workers")
+    parser.add_argument("--max-in-flight", type=int, default=NOTES_MAX_IN_FLIGHT, help="Global in-flight request cap (defaults to --workers)")
+    parser.add_argument("--batch-size", type=int, default=NOTES_BATCH_SIZE, help="Ticket IDs per batched TicketNotes query (0 = one query per ticket)")
+    parser.add_argument("--resume", action="store_true", help="Skip tickets already enriched by an interrupted run")
+    parser.add_argument("--delta", action="store_true", help="Enrich only the tickets in result1.delta and merge them into result2")
+    args = parser.parse_args()
+    metrics.start_stage("script2_tickets")
+
+    if args.delta:
+        handler("result1.delta", "result2.delta", args.workers, args.rps, args.max_in_flight, args.batch_size, args.resume, "script2_tickets_delta")
+        changed, total = merge_delta("result2")
+        logging.info(f"Merged {changed} changed tickets into result2 ({total} tickets).")
+    else:
+        handler("result1", "result2", args.workers, args.rps, args.max_in_flight, args.batch_size, args.resume)
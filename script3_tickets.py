@@ -1,27 +1,112 @@
 import json
+import logging
+import logs
+import multiprocessing
 import os
+from functools import cached_property
+from id_map import load_crosswalk
+from dead_letters import DeadLetters
+from lookup_index import load_index, normalize_email
+from projection import AteraContact, Contact, Named, Resource, Technician
+import argparse
+import staging
+from artifacts import count_artifact, merge_delta, open_line_reader, open_reader, open_writer, use_staging
+import metrics
+import reference_cache
+from workers import available_cores, chunked, ordered_process_map
+
+REFERENCE_FOLDER = "json_files"
+# Mapping processes (0 = one per available core; 1 maps in this process)
+MAPPING_WORKERS = int(os.getenv("MAPPING_WORKERS", "0")) or available_cores()
+# Tickets sent to a mapping process per task
+MAPPING_CHUNK_SIZE = int(os.getenv("MAPPING_CHUNK_SIZE", "200"))
+# Bad input data; any other exception is a bug and still ends the run
+MAPPING_ERRORS = (KeyError, TypeError, ValueError)
 
 def load_json(file_path):
     with open(file_path, 'r') as file:
         return json.load(file)
 
-all_contacts = load_json(os.path.join("json_files", "all_contacts.json"))
-all_priorities = load_json(os.path.join("json_files", "all_priority.json"))
-all_statuses = load_json(os.path.join("json_files", "all_status.json"))
-all_resources = load_json(os.path.join("json_files", "all_resources.json"))
-all_technicians = load_json(os.path.join("json_files", "atera_technicians.json"))
-atera_contacts = load_json(os.path.join("json_files", "atera_contacts.json"))
+def reference_file(name):
+    return os.path.join(REFERENCE_FOLDER, name)
+
+class ReferenceData:
+    """Hash indexes over the reference files, each loaded on first use.
+
+    Importing this module reads nothing; an index is built (or read back from
+    its marshal snapshot) the first time a lookup needs it. Records are kept
+    as the compact types from projection.py, holding only the fields read here.
+    """
+
+    @cached_property
+    def priorities_by_id(self):
+        return load_index(reference_file("all_priority.json"), 'id', record_type=Named)
+
+    @cached_property
+    def statuses_by_id(self):
+        return load_index(reference_file("all_status.json"), 'id', record_type=Named)
+
+    @cached_property
+    def contacts_by_id(self):
+        return load_index(reference_file("all_contacts.json"), 'id', record_type=Contact)
+
+    @cached_property
+    def resources_by_id(self):
+        return load_index(reference_file("all_resources.json"), 'id', record_type=Resource)
+
+    @cached_property
+    def technicians_by_email(self):
+        return load_index(reference_file("atera_technicians.json"), 'Email', email=True, record_type=Technician)
+
+    @cached_property
+    def atera_contacts_by_email(self):
+        path = reference_file("atera_contacts.json")
+        if not os.path.exists(path):
+            # Only needed for contacts missing from the crosswalk; run fetch_atera_contacts.py to reconcile them
+            logging.warning(f"'{path}' not found; contacts outside the crosswalk go by name and email.")
+            return {}
+        return load_index(path, 'Email', email=True, record_type=AteraContact)
+
+    @cached_property
+    def crosswalk(self):
+        return load_crosswalk()
+
+reference = ReferenceData()
+
+REFERENCE_INDEXES = (
+    "priorities_by_id", "statuses_by_id", "contacts_by_id", "resources_by_id",
+    "technicians_by_email", "atera_contacts_by_email", "crosswalk",
+)
+
+def preload_reference():
+    """Loads every index now instead of on its first lookup."""
+    for name in REFERENCE_INDEXES:
+        getattr(reference, name)
+
+def use_staged_indexes(store=True):
+    """Serves every lookup from the indexed staging tables instead of the in-memory dicts."""
+    if store:
+        # These three are exported by hand, so they reach the staging DB here rather than from a fetch script
+        staging.store_reference("priorities", load_json(reference_file("all_priority.json")))
+        staging.store_reference("statuses", load_json(reference_file("all_status.json")))
+        staging.store_reference("technicians", load_json(reference_file("atera_technicians.json")))
+    reference.priorities_by_id = staging.TableIndex("priorities", record_type=Named)
+    reference.statuses_by_id = staging.TableIndex("statuses", record_type=Named)
+    reference.contacts_by_id = staging.TableIndex("contacts", record_type=Contact)
+    reference.resources_by_id = staging.TableIndex("resources", record_type=Resource)
+    reference.technicians_by_email = staging.TableIndex("technicians", "email", record_type=Technician)
+    reference.atera_contacts_by_email = staging.TableIndex("atera_contacts", "email", record_type=AteraContact)
 
 def get_ticket_priority(priority_id):
-    for priority in all_priorities:
-        if priority['id'] == priority_id:
-            return priority['name']
+    priority = reference.priorities_by_id.get(priority_id)
+    if priority:
+        return priority.name
     return "Low"
 
 def get_ticket_status(status_id):
-    for status in all_statuses:
-        if status['id'] == status_id:
-            return status['name']
+    status = reference.statuses_by_id.get(status_id)
+    if status:
+        return status.name
     return "New"
 
 def get_ticket_impact(issue_type):
@@ -44,53 +129,64 @@ def get_ticket_type(ticket_type_id):
     return ticket_type_dict.get(ticket_type_id, "Incident")
 
 def get_end_user(contact_id):
-    for contact in all_contacts:
-        if contact['id'] == contact_id:
-            return {
-                'EndUserID': contact['id'],
-                'EndUserFirstName': contact['firstName'],
-                'EndUserLastName': contact['lastName'],
-                'EndUserEmail': contact['emailAddress']
-            }
+    contact = reference.contacts_by_id.get(contact_id)
+    if contact:
+        return {
+            'EndUserID': contact.id,
+            'EndUserFirstName': contact.firstName,
+            'EndUserLastName': contact.lastName,
+            'EndUserEmail': contact.emailAddress
+        }
     return {}
 
 def get_assigned_resource(resource_id):
-    for resource in all_resources:
-        if resource['id'] == resource_id:
-            return {
-                'resourceID': resource['id'],
-                'resourceFirstName': resource['firstName'],
-                'resourceLastName': resource['lastName'],
-                'resourceEmail': resource['email']
-            }
+    resource = reference.resources_by_id.get(resource_id)
+    if resource:
+        return {
+            'resourceID': resource.id,
+            'resourceFirstName': resource.firstName,
+            'resourceLastName': resource.lastName,
+            'resourceEmail': resource.email
+        }
     return {}
 
 def get_technician_id(resource_email):
-    for technician in all_technicians:
-        if technician['Email'] == resource_email:
-               return technician['$id']
-        
+    technician = reference.technicians_by_email.get(normalize_email(resource_email))
+    if technician:
+        return technician.id
+
+def get_crosswalk_id(kind, source_id):
+    """Atera ID captured for an Autotask contact or resource, if any."""
+    return reference.crosswalk[kind].get(source_id)
+
 def get_enduser_id(enduser_email):
-    for enduser in atera_contacts:
-        if enduser['Email'] == enduser_email:
-               return enduser['EndUserID']
+    enduser = reference.atera_contacts_by_email.get(normalize_email(enduser_email))
+    if enduser:
+        return enduser.EndUserID
 
 def get_ticket_comments(comments):
+    """Comments written by a resource come from its technician, the others from the contact's end user.
+
+    Authors resolve through the crosswalk first, then by email.
+    """
     result = []
     for comment in comments:
         if (comment["noteType"] == 1):
             comment_data = {
+                "SourceNoteID": comment.get("id"),
                 "CommentTimestampUTC": comment["createDateTime"],
                 "CommentText": comment["description"],
             }
-            if comment["creatorResourceID"] is None:
+            resource_id = comment["creatorResourceID"]
+            if resource_id is not None:
                 comment_data["TechnicianCommentDetails"] = {
-                    "TechnicianId": get_technician_id(get_end_user(comment["createdByContactID"]).get("EndUserEmail")),
+                    "TechnicianId": get_crosswalk_id("resource", resource_id) or get_technician_id(get_assigned_resource(resource_id).get("resourceEmail")),
                     "IsInternal": False
                 }
             else:
+                contact_id = comment["createdByContactID"]
                 comment_data["EnduserCommentDetails"] = {
-                    "EnduserId": get_enduser_id(get_assigned_resource(comment["creatorResourceID"]).get("resourceEmail"))
+                    "EnduserId": get_crosswalk_id("contact", contact_id) or get_enduser_id(get_end_user(contact_id).get("EndUserEmail"))
                 }
             result.append(comment_data)
     return result
@@ -103,10 +199,17 @@ def create_ticket_payload(ticket):
     ticket_type = get_ticket_type(ticket['ticketType'])
     end_user = get_end_user(ticket['contactID'])
     assigned_resource = get_assigned_resource(ticket['assignedResourceID'])
-    technician_contact_id = get_technician_id(assigned_resource.get('resourceEmail'))
-    end_user_id = get_enduser_id(end_user.get('EndUserEmail'))
+    technician_contact_id = (
+        get_crosswalk_id("resource", ticket['assignedResourceID'])
+        or get_technician_id(assigned_resource.get('resourceEmail'))
+    )
+    end_user_id = get_crosswalk_id("contact", ticket['contactID']) or get_enduser_id(end_user.get('EndUserEmail'))
 
     payload = {
+        "SourceTicketID": ticket.get("id"),
+        # Lets script4 resolve IDs that reached the crosswalk after this mapping ran
+        "SourceContactID": ticket['contactID'],
+        "SourceResourceID": ticket['assignedResourceID'],
         "TicketTitle": ticket["title"],
         "Description": ticket["description"],
         "TicketPriority": priority,
@@ -128,18 +231,95 @@ def create_ticket_payload(ticket):
 
     return payload
 
-def handler(ticket_data):
-    new_payloads = []
+def init_worker(staged):
+    """Runs once in each mapping process, so reference data is loaded there and never pickled with a chunk.
+
+    After a fork the indexes the parent preloaded are already here, shared copy-on-write.
+    """
+    if staged:
+        staging.forget_connection()
+        use_staged_indexes(store=False)
+    preload_reference()
+
+def map_lines(lines):
+    """Task run in a mapping process: decodes, maps and re-encodes a chunk of tickets.
+
+    Only JSON text crosses the process boundary, so the parent never parses
+    or pickles a ticket. Returns ([(SourceTicketID, payload JSON)], [(ticket id, error)]).
+    """
+    encoded = []
+    failures = []
+    for line in lines:
+        ticket = json.loads(line)
+        try:
+            payload = create_ticket_payload(ticket)
+        except MAPPING_ERRORS as e:
+            failures.append((ticket.get("id"), e))
+            continue
+        encoded.append((payload["SourceTicketID"], json.dumps(payload, separators=(",", ":"))))
+    return encoded, failures
+
+def record_failures(failures, dead_letters):
+    for ticket_id, error in failures:
+        if dead_letters is None:
+            raise error
+        logging.error(f"Could not map ticket {ticket_id}: {error!r}")
+        dead_letters.record(ticket_id, repr(error))
+
+def map_tickets(ticket_data, dead_letters=None):
+    """Yields Atera payloads; tickets that cannot be mapped go to `dead_letters` instead of ending the run."""
     for ticket in ticket_data:
-        payload = create_ticket_payload(ticket)
-        new_payloads.append(payload)
-    return new_payloads
+        try:
+            payload = create_ticket_payload(ticket)
+        except MAPPING_ERRORS as e:
+            record_failures([(ticket.get("id"), e)], dead_letters)
+            continue
+        yield payload
+        metrics.add_records()
+
+def map_encoded(lines, dead_letters=None, workers=MAPPING_WORKERS, chunk_size=MAPPING_CHUNK_SIZE):
+    """Maps JSON-encoded tickets on a process pool; yields (SourceTicketID, payload JSON) in input order."""
+    if multiprocessing.get_start_method() == "fork":
+        # Loaded before the pool forks, so every worker starts with the indexes in place
+        preload_reference()
+    chunks = ordered_process_map(map_lines, chunked(lines, chunk_size), workers, init_worker, (use_staging(),))
+    for encoded, failures in chunks:
+        record_failures(failures, dead_letters)
+        yield from encoded
+        metrics.add_records(len(encoded))
+
+def handler(ticket_data):
+    return list(map_tickets(ticket_data))
 
 if __name__ == "__main__":
-    tickets = load_json('result2.json')
-    new_ticket_payloads = handler(tickets)
+    parser = argparse.ArgumentParser(description="Map enriched tickets to Atera ticket payloads.")
+    parser.add_argument("--delta", action="store_true", help="Map only result2.delta and merge it into result3")
+    parser.add_argument("--workers", type=int, default=MAPPING_WORKERS, help="Mapping processes (1 maps in this process)")
+    parser.add_argument("--chunk-size", type=int, default=MAPPING_CHUNK_SIZE, help="Tickets per task sent to a mapping process")
+    args = parser.parse_args()
+    # Set up here rather than at import, so mapping processes and replay.py leave the log file alone
+    logs.setup(os.path.join(logs.LOG_FOLDER, 'log3.log'))
+
+    # Served from disk while their TTLs last; refetched from the APIs once stale
+    reference_cache.ensure(["priorities", "statuses", "technicians"])
+    if use_staging():
+        use_staged_indexes()
 
-    with open(os.path.join("json_files", "result3.json"), 'w') as f:
-        json.dump(new_ticket_payloads, f, indent=4)
+    suffix = ".delta" if args.delta else ""
+    metrics.start_stage("script3_tickets")
+    if metrics.PROGRESS_INTERVAL:
+        metrics.expect_records(count_artifact("result2" + suffix))
+    dead_letters = DeadLetters("script3_tickets", {"artifact": "result2" + suffix, "key": "id"}, reset=not args.delta)
+    with open_writer("result3" + suffix, key="SourceTicketID") as writer, dead_letters:
+        if args.workers > 1:
+            for key, line in map_encoded(open_line_reader("result2" + suffix), dead_letters, args.workers, args.chunk_size):
+                writer.write_encoded(line, key)
+        else:
+            writer.write_all(map_tickets(open_reader("result2" + suffix), dead_letters))
 
-    print(f"Processed {len(new_ticket_payloads)} tickets and saved to 'result3.json'.")
+    print(f"Processed {writer.count} tickets and saved to '{writer.path}'.")
+    if dead_letters.count:
+        print(f"{dead_letters.count} tickets could not be mapped; see '{dead_letters.path}' and run 'python replay.py script3_tickets'.")
+    if args.delta:
+        changed, total = merge_delta("result3", key="SourceTicketID")
+        print(f"Merged {changed} changed tickets into result3 ({total} tickets).")
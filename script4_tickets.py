@@ -1,37 +1,42 @@
-import requests
-import json
-import time
+import argparse
 import logging
+import logs
 import os
 from requests.exceptions import RequestException
 from dotenv import load_dotenv
+from workers import ordered_map
+import http_client
+from http_client import ATERA_API_ROOT, atera_headers
+import staging
+from artifacts import count_artifact, open_reader, use_staging
+from checkpoint import ProgressLedger
+from id_map import IdMap
+from dead_letters import DeadLetters
+import metrics
 
 load_dotenv()
 
 # Constants
-ATERA_API_URL = "https://app.atera.com/api/v3/tickets"
-ATERA_API_COMMENT_URL = "https://app.atera.com/api/v3/tickets/{id}/comments"
-API_KEY = os.getenv("ATERA_API_KEY")
-RESULT_FILE = os.path.join("json_files", "result3.json")
-RETRY_LIMIT = 3
-DELAY_SECONDS = 5
+ATERA_API_URL = f"{ATERA_API_ROOT}/tickets"
+ATERA_API_COMMENT_URL = ATERA_API_ROOT + "/tickets/{id}/comments"
+RESULT_ARTIFACT = "result3"
+POST_WORKERS = int(os.getenv("POST_WORKERS", "1"))
+# Keys script3 adds for bookkeeping that are never sent to Atera
+LOCAL_FIELDS = ("SourceTicketID", "SourceNoteID", "SourceContactID", "SourceResourceID")
+END_USER_FIELDS = ("EndUserFirstName", "EndUserLastName", "EndUserEmail")
 
 # Set up logging
-logging.basicConfig(filename='error_log.log', level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
-success_logger = logging.getLogger('success_logger')
-success_handler = logging.FileHandler('success_log.log')
-success_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
-success_logger.addHandler(success_handler)
+logs.setup('error_log.log', level=logging.ERROR)
+success_logger = logs.setup('success_log.log', logger='success_logger', fmt='%(asctime)s - %(message)s')
+success_logger.propagate = False
 
 # Helper Functions
-def post_ticket(ticket_data):
-    headers = {
-        'Authorization': f'Bearer {API_KEY}',
-        'Content-Type': 'application/json'
-    }
+def strip_local_fields(data):
+    return {key: value for key, value in data.items() if key not in LOCAL_FIELDS}
 
+def post_ticket(ticket_data):
     try:
-        response = requests.post(ATERA_API_URL, headers=headers, json=ticket_data)
+        response = http_client.post(ATERA_API_URL, headers=atera_headers(), json=strip_local_fields(ticket_data))
         response.raise_for_status()
 
         response_data = response.json()
@@ -39,61 +44,160 @@ def post_ticket(ticket_data):
         if not ticket_id:
             raise ValueError("Ticket ID not found in the response")
 
-        success_logger.info(f"Successfully posted ticket: {ticket_data['TicketTitle']} | Ticket ID: {ticket_id}")
-        print(f"Successfully posted ticket: {ticket_data['TicketTitle']} | Ticket ID: {ticket_id}")
+        # Lazy arguments: with LOG_SAMPLE_EVERY / LOG_RATE_LIMIT set, a suppressed line is never formatted
+        success_logger.info("Successfully posted ticket: %s | Ticket ID: %s", ticket_data['TicketTitle'], ticket_id)
 
         return ticket_id
 
-    except RequestException as e:
+    except (RequestException, ValueError) as e:
         logging.error(f"Error posting ticket {ticket_data['TicketTitle']} | Error: {e}")
-        return None
+        raise
 
 def post_comment(ticket_id, comment):
-    headers = {
-        'Authorization': f'Bearer {API_KEY}',
-        'Content-Type': 'application/json'
-    }
     url = ATERA_API_COMMENT_URL.format(id=ticket_id)
 
     try:
-        response = requests.post(url, headers=headers, json=comment)
+        response = http_client.post(url, headers=atera_headers(), json=strip_local_fields(comment))
         response.raise_for_status()
 
-        success_logger.info(f"Successfully posted comment to ticket {ticket_id}: {comment['Text']}")
-        print(f"Successfully posted comment to ticket {ticket_id}: {comment['Text']}")
+        success_logger.info("Successfully posted comment to ticket %s: %s", ticket_id, comment.get('CommentText'))
+        return True
 
     except RequestException as e:
         logging.error(f"Error posting comment to ticket {ticket_id} | Error: {e}")
+        raise
+
+def resolve_identities(ticket, id_map):
+    """Fills in an end user or technician script3 could not resolve but the crosswalk now knows."""
+    if not id_map:
+        return ticket
+    end_user_id = None if ticket.get("EndUserID") else id_map.get("contact", ticket.get("SourceContactID"))
+    technician_id = None if ticket.get("TechnicianContactID") else id_map.get("resource", ticket.get("SourceResourceID"))
+    if not end_user_id and not technician_id:
+        return ticket
+    ticket = dict(ticket)
+    if end_user_id:
+        ticket["EndUserID"] = end_user_id
+        for field in END_USER_FIELDS:
+            ticket.pop(field, None)
+    if technician_id:
+        ticket["TechnicianContactID"] = technician_id
+    return ticket
+
+def migrate_ticket(ticket, ledger=None, id_map=None, dead_letters=None, trust_ledger=True):
+    """Posts one ticket, then its comments in order. Runs inside a worker so backoff only stalls this ticket.
+
+    Tickets and notes already in the id map are not posted again; a ticket
+    whose comments only partly made it over gets just the missing ones.
+    Without `trust_ledger` (delta runs) a ticket the ledger has is still
+    checked for new comments. Returns True when the ticket and all its
+    comments are in Atera, and only then marks it done in the ledger; what
+    failed is recorded in `dead_letters`.
+    """
+    source_id = ticket.get("SourceTicketID")
+    if trust_ledger and ledger and source_id is not None and ledger.is_done(source_id):
+        return True
+
+    ticket_id = id_map.get("ticket", source_id) if id_map and source_id is not None else None
+    success = bool(ticket_id)
+    error = None
+    if success:
+        success_logger.info("Ticket %s already migrated as Atera ticket %s; skipping the ticket post", source_id, ticket_id)
+
+    else:
+        ticket = resolve_identities(ticket, id_map)
+        # Posted once: http_client already resent it where Atera provably did not process it. After a read
+        # timeout, a 5xx or an unreadable response the ticket may exist, so it is dead-lettered, not resent.
+        try:
+            ticket_id = post_ticket(ticket)
+        except (RequestException, ValueError) as e:
+            error = e
+        success = bool(ticket_id)
+        if success and id_map:
+            id_map.record("ticket", source_id, ticket_id)
+
+    if success:
+        # Post comments if available
+        comments = ticket.get('comments', [])
+        for comment in comments:
+            note_id = comment.get("SourceNoteID")
+            if id_map and note_id is not None and id_map.has("note", note_id):
+                continue
+            try:
+                post_comment(ticket_id, comment)
+            except RequestException as e:
+                success = False
+                if dead_letters:
+                    # Replaying the ticket posts only the comments still missing from the id map
+                    dead_letters.record(source_id, e, note_id=note_id, atera_ticket_id=ticket_id)
+                continue
+            if id_map:
+                id_map.record("note", note_id, ticket_id)
+        # A ticket with failed comments stays out of the ledger, so --resume posts just the missing ones
+        if success and ledger and source_id is not None:
+            ledger.mark_done(source_id)
+
+    else:
+        logging.error(f"Failed to post ticket {ticket['TicketTitle']}; check Atera for it before replaying: {error}")
+        if dead_letters:
+            dead_letters.record(source_id, error)
+
+    return success
+
+def handler(workers=POST_WORKERS, artifact=RESULT_ARTIFACT, resume=False, delta=False):
+    posted = 0
+    processed = 0
+    # Small batches: a mark lost in a crash only costs an id map lookup per ticket on resume
+    ledger = ProgressLedger("script4_tickets", resume=resume, flush_every=50, flush_interval=1.0)
+    if resume:
+        success_logger.info(f"Resuming: {len(ledger.done)} tickets already posted will be skipped")
+    id_map = IdMap()
+    success_logger.info(
+        f"Id map holds {id_map.count('ticket')} migrated tickets and {id_map.count('note')} migrated notes; "
+        f"crosswalk holds {id_map.count('contact')} contacts and {id_map.count('resource')} resources"
+    )
+
+    staged = use_staging()
+    dead_letters = DeadLetters("script4_tickets", {"artifact": artifact, "key": "SourceTicketID"}, reset=not resume)
+
+    def migrate(ticket):
+        success = migrate_ticket(ticket, ledger, id_map, dead_letters, trust_ledger=not delta)
+        if success and staged:
+            staging.mark_posted(artifact, ticket.get("SourceTicketID"))
+        return success
 
-def handler():
     try:
-        with open(RESULT_FILE, 'r') as file:
-            tickets = json.load(file)
-
-        for ticket in tickets:
-            success = False
-            retries = 0
+        if metrics.PROGRESS_INTERVAL:
+            metrics.expect_records(count_artifact(artifact))
+        # With the SQLite backend a resumed run only reads the rows not yet marked posted
+        for success in ordered_map(migrate, open_reader(artifact, pending_only=resume), workers):
+            processed += 1
+            posted += success
+            metrics.add_records()
 
-            while retries < RETRY_LIMIT and not success:
-                ticket_id = post_ticket(ticket)
-                success = bool(ticket_id)
-
-                if not success:
-                    retries += 1
-                    print(f"Retrying... ({retries}/{RETRY_LIMIT})")
-                    time.sleep(DELAY_SECONDS)
-
-            if success:
-                # Post comments if available
-                comments = ticket.get('comments', [])
-                for comment in comments:
-                    post_comment(ticket_id, comment)
+    except Exception as e:
+        logging.error(f"Error reading the artifact {artifact}: {e}")
 
-            else:
-                logging.error(f"Failed to post ticket after {RETRY_LIMIT} attempts: {ticket['TicketTitle']}")
+    finally:
+        id_map.close()
+        ledger.close()
+        dead_letters.close()
 
-    except Exception as e:
-        logging.error(f"Error reading the file {RESULT_FILE}: {e}")
+    success_logger.info(f"Posted {posted} of {processed} tickets with {workers} workers")
+    if dead_letters.count:
+        logging.error(f"{dead_letters.count} ticket or comment posts failed; see '{dead_letters.path}' and run 'python replay.py script4_tickets'.")
 
 if __name__ == "__main__":
-    handler()
+    parser = argparse.ArgumentParser(description="Post mapped tickets and their comments to Atera.")
+    parser.add_argument("--workers", type=int, default=POST_WORKERS, help="Tickets posted concurrently")
+    parser.add_argument("--resume", action="store_true", help="Skip tickets already posted by an interrupted run")
+    parser.add_argument("--delta", action="store_true", help="Post new tickets from result3.delta and the new comments of changed ones")
+    args = parser.parse_args()
+    metrics.start_stage("script4_tickets")
+
+    if args.delta:
+        # Posted tickets are never updated in place: a delta run keeps the ledger, posts new tickets
+        # and adds the comments the id map does not have yet to tickets posted before
+        handler(args.workers, RESULT_ARTIFACT + ".delta", resume=True, delta=True)
+    else:
+        handler(args.workers, resume=args.resume)
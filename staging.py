@@ -0,0 +1,215 @@
+import json
+import os
+import sqlite3
+import threading
+from lookup_index import normalize_email
+from projection import compact
+
+STAGING_DB = os.path.join("json_files", "staging.db")
+
+# Reference tables: (id column source, normalized email column source) per entity
+REFERENCE_TABLES = {
+    "contacts": ("id", "emailAddress"),
+    "resources": ("id", "email"),
+    "atera_contacts": ("EndUserID", "Email"),
+    "technicians": ("ContactID", "Email"),
+    "priorities": ("id", None),
+    "statuses": ("id", None),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    artifact TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    key INTEGER,
+    posted INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL,
+    PRIMARY KEY (artifact, seq)
+);
+CREATE INDEX IF NOT EXISTS records_key ON records (artifact, key);
+CREATE INDEX IF NOT EXISTS records_pending ON records (artifact, posted, seq);
+""" + "".join(
+    f"""
+CREATE TABLE IF NOT EXISTS {table} (id PRIMARY KEY, email TEXT, data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS {table}_email ON {table} (email);
+""" for table in REFERENCE_TABLES
+)
+
+_connection = None
+_lock = threading.RLock()
+
+def forget_connection():
+    """Drops the connection inherited from a parent process; SQLite connections must not cross a fork."""
+    global _connection, _lock
+    _connection = None
+    # A lock held by another thread at fork time would never be released in the child
+    _lock = threading.RLock()
+
+def connect():
+    """Returns the process-wide staging connection, shared by all threads under one lock."""
+    global _connection
+    with _lock:
+        if _connection is None:
+            os.makedirs(os.path.dirname(STAGING_DB), exist_ok=True)
+            connection = sqlite3.connect(STAGING_DB, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SCHEMA)
+            _connection = connection
+        return _connection
+
+def store_reference(table, records):
+    """Bulk-upserts reference records into `table`, indexed by id and normalized email."""
+    id_field, email_field = REFERENCE_TABLES[table]
+    rows = [
+        (record.get(id_field), normalize_email(record.get(email_field)) if email_field else None, json.dumps(record))
+        for record in records
+    ]
+    with _lock:
+        connection = connect()
+        with connection:
+            connection.executemany(f"INSERT OR REPLACE INTO {table} (id, email, data) VALUES (?, ?, ?)", rows)
+    return len(rows)
+
+class TableIndex:
+    """Read-only, dict-like view over a reference table, looked up through its index.
+
+    Mirrors the in-memory indexes script3 builds, so its resolvers work unchanged.
+    """
+
+    def __init__(self, table, column="id", record_type=None):
+        self.query = f"SELECT data FROM {table} WHERE {column} = ? LIMIT 1"
+        self.record_type = record_type
+
+    def get(self, key, default=None):
+        if key is None:
+            return default
+        with _lock:
+            row = connect().execute(self.query, (key,)).fetchone()
+        if not row:
+            return default
+        record = json.loads(row[0])
+        return compact(self.record_type, record) if self.record_type else record
+
+class TableWriter:
+    """Stores an artifact as rows of the `records` table; same interface as artifacts.RecordWriter.
+
+    Rows are committed in batches on `flush`. Without `resume` the artifact's
+    previous rows are dropped, so a stage always starts from a clean table.
+    """
+
+    def __init__(self, name, key="id", resume=False, batch_size=1000):
+        self.name = name
+        self.path = f"{STAGING_DB}:{name}"
+        self.key = key
+        self.batch_size = batch_size
+        self.buffer = []
+        with _lock:
+            connection = connect()
+            if not resume:
+                with connection:
+                    connection.execute("DELETE FROM records WHERE artifact = ?", (name,))
+            self.count = connection.execute("SELECT COUNT(*) FROM records WHERE artifact = ?", (name,)).fetchone()[0]
+        self.next_seq = self.count
+
+    def salvage(self, keep=None):
+        """Yields rows committed by an interrupted run, dropping those `keep` rejects."""
+        if not self.count:
+            return
+        self.count = 0
+        discarded = []
+        for seq, record in _select(self.name):
+            if discarded or (keep is not None and not keep(record)):
+                discarded.append(seq)
+                continue
+            self.count += 1
+            yield record
+        if discarded:
+            # Everything after the first rejected row is refetched, so the kept rows stay an in-order prefix
+            with _lock:
+                connection = connect()
+                with connection:
+                    connection.execute("DELETE FROM records WHERE artifact = ? AND seq >= ?", (self.name, discarded[0]))
+            self.next_seq = discarded[0]
+
+    def write(self, record):
+        self.write_encoded(json.dumps(record, separators=(",", ":")), record.get(self.key))
+
+    def write_encoded(self, data, key=None):
+        """Stores a record that is already JSON-encoded; `key` is its value for this writer's key field."""
+        self.buffer.append((self.name, self.next_seq, key, data))
+        self.next_seq += 1
+        self.count += 1
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def write_all(self, records):
+        for record in records:
+            self.write(record)
+
+    def flush(self):
+        if not self.buffer:
+            return
+        with _lock:
+            connection = connect()
+            with connection:
+                connection.executemany("INSERT OR REPLACE INTO records (artifact, seq, key, data) VALUES (?, ?, ?, ?)", self.buffer)
+        self.buffer = []
+
+    def close(self, commit=True):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def _select(name, condition="", decode=True):
+    # Page through the table so a long scan never holds the shared connection between rows
+    query = f"SELECT seq, data FROM records WHERE artifact = ? {condition} AND seq > ? ORDER BY seq LIMIT 1000"
+    last_seq = -1
+    while True:
+        with _lock:
+            rows = connect().execute(query, (name, last_seq)).fetchall()
+        if not rows:
+            return
+        for seq, data in rows:
+            yield seq, json.loads(data) if decode else data
+        last_seq = rows[-1][0]
+
+def artifact_exists(name):
+    with _lock:
+        return connect().execute("SELECT 1 FROM records WHERE artifact = ? LIMIT 1", (name,)).fetchone() is not None
+
+def count_staged(name):
+    with _lock:
+        return connect().execute("SELECT COUNT(*) FROM records WHERE artifact = ?", (name,)).fetchone()[0]
+
+def read_staged(name, pending_only=False, decode=True):
+    """Streams an artifact's records in write order with a paged cursor; `decode=False` yields the JSON text."""
+    for _, record in _select(name, "AND posted = 0" if pending_only else "", decode):
+        yield record
+
+def mark_posted(name, key):
+    with _lock:
+        connection = connect()
+        with connection:
+            connection.execute("UPDATE records SET posted = 1 WHERE artifact = ? AND key = ?", (name, key))
+
+def merge_staged_delta(name, suffix=".delta"):
+    """Upserts the rows of `<name><suffix>` into `name` by their key; returns (changed, total)."""
+    delta_name = name + suffix
+    changed = 0
+    with _lock:
+        connection = connect()
+        with connection:
+            next_seq = connection.execute("SELECT COALESCE(MAX(seq) + 1, 0) FROM records WHERE artifact = ?", (name,)).fetchone()[0]
+            for row_key, data in connection.execute("SELECT key, data FROM records WHERE artifact = ? ORDER BY seq", (delta_name,)).fetchall():
+                changed += 1
+                updated = connection.execute("UPDATE records SET data = ? WHERE artifact = ? AND key = ?", (data, name, row_key)).rowcount
+                if not updated:
+                    connection.execute("INSERT INTO records (artifact, seq, key, data) VALUES (?, ?, ?, ?)", (name, next_seq, row_key, data))
+                    next_seq += 1
+        total = connection.execute("SELECT COUNT(*) FROM records WHERE artifact = ?", (name,)).fetchone()[0]
+    return changed, total
@@ -0,0 +1,35 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+import migrate
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        patcher = mock.patch.object(migrate, "STATE_FILE", os.path.join(folder.name, "migrate_state.json"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_failing(self, failing, targets):
+        def run_stage(name, flags):
+            return ("failed", 0.0) if name == failing else ("done", 0.0)
+
+        with mock.patch.object(migrate, "run_stage", side_effect=run_stage):
+            return migrate.handler(targets, force=True)
+
+    def test_failed_after_stage_blocks_its_dependents(self):
+        results = self.run_failing("fetch_atera_contacts", ["tickets", "reconcile"])
+        self.assertEqual(results["fetch_atera_contacts"][0], "failed")
+        self.assertEqual(results["script3_tickets"][0], "blocked")
+        self.assertEqual(results["script4_tickets"][0], "blocked")
+        self.assertEqual(results["script2_tickets"][0], "done")
+
+    def test_unselected_after_stage_is_not_waited_for(self):
+        results = self.run_failing(None, ["tickets"])
+        self.assertNotIn("fetch_atera_contacts", results)
+        self.assertEqual(results["script4_tickets"][0], "done")
+
+if __name__ == "__main__":
+    unittest.main()
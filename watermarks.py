@@ -0,0 +1,65 @@
+import json
+import logging
+import os
+from datetime import datetime, timezone
+
+WATERMARK_FILE = os.path.join("json_files", "watermarks.json")
+
+# Change-tracking field per Autotask entity. Resources have no modification
+# timestamp, so they are always fetched in full (a handful of pages).
+WATERMARK_FIELDS = {
+    "Tickets": "lastActivityDate",
+    "Contacts": "lastModifiedDate",
+}
+
+def load_watermarks():
+    if not os.path.exists(WATERMARK_FILE):
+        return {}
+    with open(WATERMARK_FILE, "r") as f:
+        return json.load(f)
+
+def get_watermark(entity):
+    return load_watermarks().get(entity)
+
+def save_watermark(entity, value):
+    """Stores the high-water mark for `entity`; written atomically so a crash never loses the previous one."""
+    if value is None:
+        return
+    watermarks = load_watermarks()
+    watermarks[entity] = value
+    os.makedirs(os.path.dirname(WATERMARK_FILE), exist_ok=True)
+    temp_file = WATERMARK_FILE + ".tmp"
+    with open(temp_file, "w") as f:
+        json.dump(watermarks, f, indent=4)
+    os.replace(temp_file, WATERMARK_FILE)
+    logging.info(f"Saved {entity} watermark {value}")
+
+def parse_timestamp(value):
+    moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment
+
+def delta_filters(entity, since):
+    """Autotask filter for records of `entity` changed at or after `since` (overlap is merged away by id)."""
+    return [{"op": "gte", "field": WATERMARK_FIELDS[entity], "value": since}]
+
+class WatermarkTracker:
+    """Tracks the latest change timestamp seen across fetched records."""
+
+    def __init__(self, entity):
+        self.field = WATERMARK_FIELDS.get(entity)
+        self.value = None
+        self.latest = None
+
+    def observe(self, records):
+        if not self.field:
+            return
+        for record in records:
+            value = record.get(self.field)
+            if not value:
+                continue
+            moment = parse_timestamp(value)
+            if self.latest is None or moment > self.latest:
+                self.latest = moment
+                self.value = value
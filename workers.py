@@ -0,0 +1,227 @@
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+class RateLimiter:
+    """Global requests-per-second and in-flight budget shared by all worker threads."""
+
+    def __init__(self, requests_per_second, max_in_flight):
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+    def acquire(self):
+        self.in_flight.acquire()
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def release(self):
+        self.in_flight.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+def ordered_map(fn, items, workers, window=None):
+    """Maps fn over items on a thread pool, yielding results in input order.
+
+    At most `window` items are submitted ahead of the consumer, so the input
+    is never fully materialised.
+    """
+    window = window or workers * 4
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(fn, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def ordered_process_map(fn, items, workers, initializer=None, initargs=(), window=None):
+    """Maps fn over items on a process pool, yielding results in input order.
+
+    For CPU-bound work. As with ordered_map, at most `window` items are
+    submitted ahead of the consumer. `fn`, the items and the results are
+    pickled; state every task needs belongs in `initializer`, which runs once
+    per worker process.
+    """
+    window = window or workers * 2
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(fn, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def available_cores():
+    """CPUs this process may run on, which can be fewer than the machine has."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0)) or 1
+    return os.cpu_count() or 1
+
+def chunked(items, size):
+    iterator = iter(items)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+class WorkQueue:
+    """Bounded hand-off from a producer to a pool of consumer threads.
+
+    `put` blocks while the queue is full, so a fast producer is held back to
+    the consumers' pace and memory stays bounded. Errors raised by `handle`
+    are logged and do not stop the consumer.
+    """
+
+    _STOP = object()
+
+    def __init__(self, handle, workers, maxsize):
+        self.handle = handle
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.threads = [threading.Thread(target=self._consume, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def _consume(self):
+        while True:
+            item = self.queue.get()
+            if item is self._STOP:
+                return
+            try:
+                self.handle(item)
+            except Exception:
+                logging.exception("Unhandled error while processing a queued item")
+
+    def put(self, item):
+        self.queue.put(item)
+
+    def close(self):
+        """Waits until every queued item has been handled."""
+        for _ in self.threads:
+            self.queue.put(self._STOP)
+        for thread in self.threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class AdaptiveLimiter:
+    """Concurrency limit that adapts to the server, AIMD-style, with a circuit breaker.
+
+    Each success adds 1/limit to the limit (+1 per window of requests); a 429
+    or a response slower than `target_latency` multiplies it by
+    `decrease_factor`, at most once per `decrease_interval` so one burst of
+    throttled responses counts once. `ceiling` caps the limit from outside
+    (e.g. quota usage). After `failure_threshold` consecutive connection
+    errors or 5xx responses the circuit opens: callers wait `cooldown`
+    seconds, then a single probe request decides whether it closes again.
+    """
+
+    def __init__(self, name, maximum, minimum=1, initial=None, target_latency=5.0, decrease_factor=0.5,
+                 decrease_interval=1.0, failure_threshold=5, cooldown=30.0, max_cooldown=300.0):
+        self.name = name
+        self.maximum = maximum
+        self.minimum = minimum
+        self.ceiling = maximum
+        self.limit = float(initial or maximum)
+        self.target_latency = target_latency
+        self.decrease_factor = decrease_factor
+        self.decrease_interval = decrease_interval
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.in_flight = 0
+        self.failures = 0
+        self.open_until = None
+        self.probing = False
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                if self.open_until is None:
+                    if self.in_flight < max(self.minimum, int(self.limit)):
+                        break
+                    self.condition.wait()
+                    continue
+                remaining = self.open_until - time.monotonic()
+                if remaining <= 0 and not self.probing and self.in_flight == 0:
+                    self.probing = True
+                    break
+                self.condition.wait(remaining if remaining > 0 else None)
+            self.in_flight += 1
+
+    def release(self, latency=None, status=None, failed=False):
+        """Returns a slot and feeds the outcome back: `failed` for connection errors, else the response status."""
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if failed or (status is not None and status >= 500 and status != 503):
+                self._failure(now)
+            elif status == 429 or status == 503 or (latency is not None and latency > self.target_latency):
+                self._success()
+                self._decrease(now, f"status {status}" if status in (429, 503) else f"latency {latency:.1f}s")
+            elif status is not None:
+                self._success()
+                self.limit = min(self.limit + 1 / self.limit, self.ceiling)
+            else:
+                # The request never got an answer for reasons unrelated to the server
+                self.probing = False
+            self.condition.notify_all()
+
+    def _success(self):
+        self.failures = 0
+        if self.open_until is not None:
+            logging.warning(f"{self.name}: requests are succeeding again, closing the circuit")
+        self.open_until = None
+        self.probing = False
+        self.cooldown = self.base_cooldown
+
+    def _failure(self, now):
+        self.failures += 1
+        if self.probing:
+            self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+        if self.probing or self.failures >= self.failure_threshold:
+            self.open_until = now + self.cooldown
+            logging.error(f"{self.name}: {self.failures} failed requests in a row, pausing requests for {self.cooldown:.1f}s")
+        self.probing = False
+
+    def _decrease(self, now, reason):
+        if now - self.last_decrease < self.decrease_interval:
+            return
+        self.last_decrease = now
+        self.limit = max(float(self.minimum), self.limit * self.decrease_factor)
+        logging.warning(f"{self.name}: {reason}, concurrency limit lowered to {int(self.limit)}")
+
+    def set_ceiling(self, ceiling):
+        with self.condition:
+            ceiling = max(self.minimum, min(self.maximum, ceiling))
+            if ceiling != self.ceiling:
+                logging.info(f"{self.name}: concurrency ceiling set to {ceiling}")
+            self.ceiling = ceiling
+            self.limit = min(self.limit, ceiling)
+            self.condition.notify_all()